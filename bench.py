@@ -0,0 +1,254 @@
+import os
+import sys
+import gc
+import json
+import time
+import random
+import shutil
+import struct
+import argparse
+import tempfile
+import platform
+import tracemalloc
+
+#   Benchmarks of the scan, id resolution, search, preview, duplicate and
+#   remap code paths over a generated inject tree. Run as
+#       python bench.py --count 50000 --output bench.json
+#   Every stage is timed once without tracing, then run again under
+#   tracemalloc for its peak memory (skip with --no-memory). Results are
+#   written as JSON so runs can be compared.
+
+TEX_SIZE = 16
+TEX_MIPS = 3
+FILES_PER_DIR = 200
+
+def dds_file(width, height, mips, data):
+    # DXT1 texture with a full header, data is the whole mip chain
+    flags = 0x1 | 0x2 | 0x4 | 0x1000 | 0x20000 | 0x80000
+    header = struct.pack(
+        '<4s7I44x2I4s5I4I4x',
+        b'DDS ', 124, flags, height, width, max(1, width // 4) * max(1, height // 4) * 8, 0, mips,
+        32, 0x4, b'DXT1', 0, 0, 0, 0, 0,
+        0x1000 | 0x400000 | 0x8, 0, 0, 0
+    )
+    return header + data
+
+def chain_size(width, height, mips):
+    size = 0
+    for _ in range(mips):
+        size += max(1, width // 4) * max(1, height // 4) * 8
+        width, height = max(1, width // 2), max(1, height // 2)
+    return size
+
+def sample_hexes(mapping_df, count, rng):
+    # Hexes of final.csv first, random ones once those run out
+    import mapping
+
+    known = [] if mapping_df is None else sorted(set(mapping.format_hex(mapping_df['texhash'].dropna())))
+    rng.shuffle(known)
+    hexes = known[:count]
+    seen = set(hexes)
+    while len(hexes) < count:
+        h = '%08X' % rng.getrandbits(32)
+        if h not in seen:
+            seen.add(h)
+            hexes.append(h)
+    return hexes
+
+def directories(count, depth):
+    # Relpaths of enough directories for count files, depth levels deep
+    leaves = max(1, -(-count // FILES_PER_DIR))
+    fanout = max(2, int(round(leaves ** (1.0 / depth)))) if depth > 0 else 1
+    dirs = ['']
+    for level in range(depth):
+        dirs = [os.path.join(d, 'dir%d_%d' % (level, i)) for d in dirs for i in range(fanout)]
+    return dirs
+
+def generate(root, count, depth, dup_ratio, mapping_df=None, seed=0):
+    # Writes count tiny DDS files below root. dup_ratio of them are byte
+    # copies of another file, with the same name, in another directory.
+    # Returns the list of relpaths.
+    rng = random.Random(seed)
+    dirs = directories(count, depth)
+    for d in dirs:
+        os.makedirs(os.path.join(root, d), exist_ok=True)
+
+    dupes = int(count * dup_ratio)
+    hexes = sample_hexes(mapping_df, count - dupes, rng)
+    size = chain_size(TEX_SIZE, TEX_SIZE, TEX_MIPS)
+
+    relpaths = []
+    contents = []
+    for i, h in enumerate(hexes):
+        data = dds_file(TEX_SIZE, TEX_SIZE, TEX_MIPS, rng.randbytes(size))
+        relpaths.append(os.path.join(dirs[i % len(dirs)], h + '.dds'))
+        contents.append(data)
+
+    for i in range(dupes):
+        source = rng.randrange(len(hexes))
+        d = dirs[(source + 1 + rng.randrange(max(1, len(dirs) - 1))) % len(dirs)]
+        relpath = os.path.join(d, os.path.basename(relpaths[source]))
+        if relpath == relpaths[source]:
+            continue
+        relpaths.append(relpath)
+        contents.append(contents[source])
+
+    for relpath, data in zip(relpaths, contents):
+        with open(os.path.join(root, relpath), 'wb') as f:
+            f.write(data)
+    return sorted(set(relpaths))
+
+def measure(name, items, func, memory):
+    # Returns (result, stage report) of func()
+    gc.collect()
+    t = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - t
+
+    report = {
+        'stage': name,
+        'seconds': round(seconds, 6),
+        'items': items,
+        'per_second': round(items / seconds, 1) if seconds > 0 else None
+    }
+    if memory:
+        del result
+        gc.collect()
+        tracemalloc.start()
+        result = func()
+        report['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 2)
+        tracemalloc.stop()
+    return result, report
+
+def run(args):
+    import numpy as np
+    import pandas as pd
+    import mapping
+    import scanner
+    import search
+    import preview
+    import dupes
+    import remap
+
+    app_path = os.path.dirname(os.path.abspath(__file__))
+    try:
+        mapping_df = mapping.load_mapping(os.path.join(app_path, 'csv', 'final.csv'), os.path.join(args.work_dir, 'mapping.cache'))
+    except ValueError:
+        mapping_df = pd.DataFrame(columns=mapping.MAPPING_COLUMNS)
+
+    root = os.path.join(args.work_dir, 'inject')
+    t = time.perf_counter()
+    relpaths = generate(root, args.count, args.depth, args.dup_ratio, mapping_df, args.seed)
+    generated = time.perf_counter() - t
+    stages = []
+
+    def stage(name, items, func):
+        result, report = measure(name, items, func, args.memory)
+        stages.append(report)
+        print('%-14s %10.3fs %12s/s %s' % (
+            name,
+            report['seconds'],
+            report['per_second'],
+            ('%.1f MB' % report['peak_mb']) if 'peak_mb' in report else ''
+        ))
+        return result
+
+    manifest_path = os.path.join(args.work_dir, 'manifest.json')
+    index = mapping.build_texhash_index(mapping_df)
+
+    def scan_cold():
+        if os.path.exists(manifest_path):
+            os.remove(manifest_path)
+        return scanner.TextureScanner(root, manifest_path, args.workers).scan(index, 'bench')
+
+    tex_df = stage('scan_cold', len(relpaths), scan_cold)
+    stage('scan_warm', len(relpaths), lambda: scanner.TextureScanner(root, manifest_path, args.workers).scan(index, 'bench'))
+
+    tex_hex = scanner.tex_hexes(tex_df)
+    stage('resolve', len(tex_hex), lambda: mapping.resolve_ids(mapping.build_texhash_index(mapping_df), tex_df['tex_hex']))
+
+    search_index = stage('search_index', len(tex_df), lambda: search.SearchIndex(tex_df, mapping_df))
+    rng = random.Random(args.seed)
+    queries = [h[:rng.randint(1, 8)] for h in rng.sample(tex_hex, min(args.queries, len(tex_hex)))]
+
+    def prefix_search():
+        for q in queries:
+            search_index.last = None
+            tex_df.iloc[search_index.prefix(q)]
+
+    stage('search_prefix', len(queries), prefix_search)
+
+    # Card names, cut to a word from their middle and with a letter dropped
+    # every other time, the way they are typed
+    names = mapping_df['cardname'].dropna().unique().tolist()
+    fuzzy_queries = []
+    for name in rng.sample(names, min(args.queries, len(names))):
+        words = name.split()
+        query = ' '.join(words[rng.randrange(len(words)):]) if words else name
+        if len(fuzzy_queries) % 2 and len(query) > 4:
+            cut = rng.randrange(1, len(query) - 1)
+            query = query[:cut] + query[cut + 1:]
+        fuzzy_queries.append(query)
+    stage('search_fuzzy', len(fuzzy_queries), lambda: [tex_df.iloc[search_index.fuzzy(q)] for q in fuzzy_queries])
+    stage('search_regex', len(queries[:20]), lambda: [search.regex(tex_df, q) for q in queries[:20]])
+
+    previews = rng.sample(scanner.tex_relpaths(tex_df), min(args.previews, len(tex_df)))
+    stage('preview', len(previews), lambda: [preview.render_preview(os.path.join(root, rp), True) for rp in previews])
+
+    stage('dupes', len(tex_df), lambda: dupes.find_duplicates(root, tex_df, {}, args.workers))
+
+    new_mapping_df = mapping_df.copy()
+    if len(new_mapping_df):
+        changed = np.random.default_rng(args.seed).random(len(new_mapping_df)) < 0.5
+        new_mapping_df.loc[changed, 'texhash'] = [rng.getrandbits(32) for _ in range(int(changed.sum()))]
+    stage('remap_plan', len(tex_df), lambda: remap.RemapPlan(root, tex_df, mapping_df, new_mapping_df))
+
+    return {
+        'version': 1,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'config': {
+            'count': args.count,
+            'depth': args.depth,
+            'dup_ratio': args.dup_ratio,
+            'seed': args.seed,
+            'workers': args.workers,
+            'files': len(relpaths),
+            'mapping_rows': len(mapping_df)
+        },
+        'generate_seconds': round(generated, 3),
+        'stages': stages
+    }
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark WStone Tracker on a generated inject tree.')
+    parser.add_argument('--count', type=int, default=10000, help='number of textures, 1000 to 200000')
+    parser.add_argument('--depth', type=int, default=2, help='directory levels below inject')
+    parser.add_argument('--dup-ratio', type=float, default=0.05, help='fraction of textures which are copies')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=8, help='scan and hash threads')
+    parser.add_argument('--queries', type=int, default=200, help='number of prefix and fuzzy searches')
+    parser.add_argument('--previews', type=int, default=100, help='number of previews to decode')
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='skip the tracemalloc pass')
+    parser.add_argument('--work-dir', help='where the tree is generated, a temporary directory by default')
+    parser.add_argument('--output', default='bench.json', help='result file')
+    args = parser.parse_args(argv)
+
+    temporary = args.work_dir is None
+    if temporary:
+        args.work_dir = tempfile.mkdtemp(prefix='wstone-bench-')
+    try:
+        result = run(args)
+    finally:
+        if temporary:
+            shutil.rmtree(args.work_dir, ignore_errors=True)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=4)
+    print('results written to %s' % args.output)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,175 @@
+import os
+import pickle
+import pandas as pd
+import diagnostics
+
+#   Rebuilds final.csv from the source tables in csv/:
+#       guid_cardname.csv - guid, dbfid, cardname of every card
+#       guid_textype_texname.csv - texture names of every card, one column per slot
+#       premium_textures.csv - matname, texname of every premium material
+#       texname_md5.csv, md5_texhash.csv - texname -> md5 -> texhash
+#   Every card gets one row per texture, in slot order: PortraitTexture, the
+#   textures of its PremiumPortraitMaterial (in premium_textures.csv order),
+#   PremiumPortraitTexture, then the three signature columns. Cards without
+#   textures are left out, texhash is empty for unknown textures.
+#   guid_premium.csv is not part of the join.
+#
+#   The parsed tables and the joined rows are kept in a state file. A build
+#   only reads tables whose size or mtime changed, expands the rows of the
+#   guids those changes touch and looks up texhash again only for rows whose
+#   texname or md5 changed. guid and texname are held as categoricals, so
+#   the texhash lookups only hash each distinct name once.
+
+STATE_VERSION = 1
+
+SOURCES = {
+    'cards': ('guid_cardname.csv', ['guid', 'dbfid', 'cardname']),
+    'slots': ('guid_textype_texname.csv', [
+        'guid', 'PortraitTexture', 'PremiumPortraitMaterial', 'PremiumPortraitTexture',
+        'SignaturePortraitTexture', 'SignaturePortraitMaterial', 'SignatureUberShaderAnimation'
+    ]),
+    'materials': ('premium_textures.csv', ['matname', 'texname']),
+    'md5': ('texname_md5.csv', ['texname', 'md5']),
+    'hashes': ('md5_texhash.csv', ['md5', 'texhash'])
+}
+
+#   Texture columns of guid_textype_texname.csv in row order, None stands
+#   for the textures of PremiumPortraitMaterial
+SLOTS = ['PortraitTexture', None, 'PremiumPortraitTexture', 'SignaturePortraitTexture', 'SignaturePortraitMaterial', 'SignatureUberShaderAnimation']
+
+def source_key(path):
+    st = os.stat(path)
+    return '%d:%d' % (st.st_mtime_ns, st.st_size)
+
+def read_source(path, columns):
+    return pd.read_csv(path, dtype=str, usecols=columns, keep_default_na=False, na_values=[''])[columns]
+
+def changed_keys(old, new, key):
+    # Values of column key on rows which are only in old or only in new
+    old_hash = pd.util.hash_pandas_object(old, index=False)
+    new_hash = pd.util.hash_pandas_object(new, index=False)
+    gone = old[key][~old_hash.isin(new_hash)]
+    came = new[key][~new_hash.isin(old_hash)]
+    return set(gone.dropna()) | set(came.dropna())
+
+def expand(slots, materials):
+    # One row per (guid, texture) of the cards in slots, with the columns
+    # guid, texname, slot and sub (the position within the slot)
+    parts = []
+    for slot, column in enumerate(SLOTS):
+        if column is None:
+            material = materials.reset_index(drop=True).rename_axis('sub').reset_index()
+            part = slots[['guid', 'PremiumPortraitMaterial']].merge(material, left_on='PremiumPortraitMaterial', right_on='matname')
+            part = part[['guid', 'texname', 'sub']]
+        else:
+            part = slots[['guid', column]].rename(columns={column: 'texname'}).assign(sub=0)
+        parts.append(part.dropna(subset=['texname']).assign(slot=slot))
+    return pd.concat(parts, ignore_index=True)
+
+def lookup_texhash(texname, md5, hashes):
+    # texname -> md5 -> texhash, texnames without one map to NaN
+    to_md5 = pd.Series(md5['md5'].values, index=md5['texname'].values)
+    to_hash = pd.Series(hashes['texhash'].values, index=hashes['md5'].values)
+    to_md5 = to_md5[~to_md5.index.duplicated()]
+    to_hash = to_hash[~to_hash.index.duplicated()]
+    return texname.map(to_md5).map(to_hash)
+
+def compact_rows(rows):
+    rows = rows.copy()
+    for column in ('guid', 'texname'):
+        if rows[column].dtype != 'category':
+            rows[column] = rows[column].astype('category')
+    return rows
+
+def load_state(state_path):
+    try:
+        with open(state_path, 'rb') as f:
+            state = pickle.load(f)
+        if state['version'] == STATE_VERSION:
+            return state
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, KeyError, TypeError):
+        pass
+    return None
+
+def save_state(state, state_path):
+    tmp_path = state_path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, state_path)
+    except OSError:
+        pass
+
+@diagnostics.span('build_mapping')
+def build(csv_dir, state_path):
+    # Returns (mapping_df, report). report has:
+    #   changed - names of the source tables which were read again
+    #   full - whether every row was rebuilt
+    #   guids - number of cards whose rows were expanded again
+    #   texnames - number of texture names whose texhash was looked up again
+    # Raises ValueError if a source table is missing.
+    state = load_state(state_path)
+    keys = {}
+    tables = {}
+    changed = []
+    for name, (file_name, columns) in SOURCES.items():
+        path = os.path.join(csv_dir, file_name)
+        try:
+            keys[name] = source_key(path)
+        except OSError:
+            raise ValueError('%s cannot be found' % file_name)
+        if state and state['keys'].get(name) == keys[name]:
+            tables[name] = state['tables'][name]
+        else:
+            try:
+                tables[name] = read_source(path, columns)
+            except ValueError as e:
+                raise ValueError('%s does not have the right format: %s' % (file_name, e))
+            changed.append(name)
+
+    slots = tables['slots']
+    report = {'changed': changed, 'full': state is None, 'guids': 0, 'texnames': 0}
+    if state is None:
+        rows = expand(slots, tables['materials'])
+        rows['texhash'] = lookup_texhash(rows['texname'], tables['md5'], tables['hashes'])
+        report['guids'] = slots['guid'].nunique()
+        report['texnames'] = rows['texname'].nunique()
+    else:
+        old = state['tables']
+        guids = set()
+        texnames = set()
+        if 'slots' in changed:
+            guids |= changed_keys(old['slots'], slots, 'guid')
+        if 'materials' in changed:
+            materials = changed_keys(old['materials'], tables['materials'], 'matname')
+            guids |= set(slots['guid'][slots['PremiumPortraitMaterial'].isin(materials)])
+        if 'md5' in changed:
+            texnames |= changed_keys(old['md5'], tables['md5'], 'texname')
+        if 'hashes' in changed:
+            md5s = changed_keys(old['hashes'], tables['hashes'], 'md5')
+            texnames |= set(tables['md5']['texname'][tables['md5']['md5'].isin(md5s)])
+
+        rows = state['rows']
+        if guids:
+            fresh = expand(slots[slots['guid'].isin(guids)], tables['materials'])
+            fresh['texhash'] = lookup_texhash(fresh['texname'], tables['md5'], tables['hashes'])
+            rows = pd.concat([rows[~rows['guid'].isin(guids)].astype({'guid': object, 'texname': object}), fresh], ignore_index=True)
+        if texnames:
+            stale = rows['texname'].isin(texnames)
+            rows = rows.copy()
+            rows['texhash'] = rows['texhash'].astype(object)
+            rows.loc[stale, 'texhash'] = lookup_texhash(rows.loc[stale, 'texname'], tables['md5'], tables['hashes'])
+        report['guids'] = len(guids)
+        report['texnames'] = len(texnames)
+
+    rows = compact_rows(rows)
+    save_state({'version': STATE_VERSION, 'keys': keys, 'tables': tables, 'rows': rows}, state_path)
+
+    # Cards in guid_textype_texname.csv order, rows of a card in slot order
+    position = pd.Series(range(len(slots)), index=slots['guid'].values)
+    position = position[~position.index.duplicated()]
+    cards = tables['cards'].drop_duplicates(subset='guid')
+    ordered = rows.assign(position=rows['guid'].map(position)).dropna(subset=['position'])
+    ordered = ordered.sort_values(['position', 'slot', 'sub'], kind='stable')
+    mapping_df = ordered[['guid', 'texname', 'texhash']].merge(cards, on='guid')
+    return mapping_df[['guid', 'dbfid', 'cardname', 'texname', 'texhash']].reset_index(drop=True), report
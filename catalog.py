@@ -0,0 +1,213 @@
+import json
+import sqlite3
+import numpy as np
+import pandas as pd
+import mapping
+import scanner
+
+#   Optional SQLite store for what otherwise lives in final.csv, the scan
+#   and data.json. Edits of a single mapping row are a single UPDATE
+#   instead of a rewrite of final.csv. Tables:
+#       mappings - final.csv, id is the index of mapping_df
+#       textures - the last scan of tex_df
+#       options - key -> json value, data['options'] is mirrored here
+#       meta - key -> value, revision is bumped by every mapping change,
+#           textures is a fingerprint of the stored scan
+#   The textures and options tables are kept in sync with the scan and
+#   data.json for other tools to query, only rows which changed are written.
+
+SCHEMA_VERSION = 1
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS mappings (
+    id INTEGER PRIMARY KEY,
+    guid TEXT,
+    dbfid INTEGER,
+    cardname TEXT,
+    texname TEXT,
+    texhash TEXT
+);
+CREATE INDEX IF NOT EXISTS mappings_texhash ON mappings (texhash);
+CREATE INDEX IF NOT EXISTS mappings_cardname ON mappings (cardname);
+CREATE INDEX IF NOT EXISTS mappings_guid ON mappings (guid);
+CREATE TABLE IF NOT EXISTS textures (
+    relpath TEXT PRIMARY KEY,
+    hex TEXT,
+    id TEXT,
+    width INTEGER,
+    height INTEGER,
+    format TEXT,
+    mips INTEGER,
+    size INTEGER,
+    vram INTEGER
+);
+CREATE INDEX IF NOT EXISTS textures_hex ON textures (hex);
+CREATE TABLE IF NOT EXISTS options (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+#   tex_df columns which make the relpath of a row
+KEY_COLUMNS = ['tex_dir', 'tex_name', 'tex_hex']
+
+#   tex_df column -> textures column, relpath and hex are rebuilt from
+#   KEY_COLUMNS
+TEXTURE_COLUMNS = {
+    'tex_id': 'id',
+    'tex_width': 'width',
+    'tex_height': 'height',
+    'tex_format': 'format',
+    'tex_mips': 'mips',
+    'tex_size': 'size',
+    'tex_vram': 'vram'
+}
+
+def hash_rows(tex_df, columns):
+    # uint64 hash of every row of columns. tex_hex is hashed as plain
+    # integers, hashing the nullable array is much slower.
+    df = tex_df[columns]
+    if 'tex_hex' in columns:
+        df = df.assign(tex_hex=tex_df['tex_hex'].to_numpy(dtype='int64', na_value=-1))
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+def texture_hashes(tex_df):
+    # (key hashes, row hashes) of tex_df for save_textures. Does not touch
+    # the connection, so it can run on a worker thread.
+    return hash_rows(tex_df, KEY_COLUMNS), hash_rows(tex_df, KEY_COLUMNS + list(TEXTURE_COLUMNS))
+
+class Catalog:
+
+    #   path is the sqlite database file, created on first use
+    #   The connection is opened by the loader thread and then only used
+    #   from the Tk thread, never from both at once.
+    #   saved is (tex_df, key hashes, row hashes) of the scan in the
+    #   textures table, set once it is known to be stored
+    #   options is the content of the options table
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+            self.conn.execute("INSERT OR IGNORE INTO meta VALUES ('schema', ?)", (str(SCHEMA_VERSION),))
+            self.conn.execute("INSERT OR IGNORE INTO meta VALUES ('revision', '0')")
+        self.saved = None
+        self.options = self.load_options()
+
+    def close(self):
+        self.conn.close()
+
+    def mapping_key(self):
+        # Plays the part of mapping.mapping_key for TextureScanner.scan
+        revision, = self.conn.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()
+        return 'catalog:%s:%s' % (self.path, revision)
+
+    def bump_revision(self):
+        self.conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'revision'")
+
+    def is_empty(self):
+        return self.conn.execute('SELECT 1 FROM mappings LIMIT 1').fetchone() is None
+
+    def load_mapping(self):
+        mapping_df = pd.read_sql_query(
+            'SELECT id, guid, dbfid, cardname, texname, texhash FROM mappings ORDER BY id',
+            self.conn,
+            index_col='id'
+        )
+        mapping_df.index.name = None
+        return mapping.compact_mapping(mapping_df)
+
+    def replace_mappings(self, mapping_df):
+        # Replaces every mapping in one transaction, ids follow the row order
+        columns = [c for c in mapping.MAPPING_COLUMNS if c in mapping_df]
+        rows = mapping.csv_frame(mapping_df[columns]).astype(object)
+        rows = rows.where(rows.notna(), None)
+        with self.conn:
+            self.conn.execute('DELETE FROM mappings')
+            self.conn.executemany(
+                'INSERT INTO mappings (id, %s) VALUES (?, %s)' % (', '.join(columns), ', '.join('?' * len(columns))),
+                ((i,) + tuple(row) for i, row in enumerate(rows.itertuples(index=False)))
+            )
+            self.bump_revision()
+
+    def set_texhash(self, mapping_id, texhash):
+        with self.conn:
+            self.conn.execute('UPDATE mappings SET texhash = ? WHERE id = ?', (texhash, int(mapping_id)))
+            self.bump_revision()
+
+    def import_csv(self, csv_path):
+        # Raises ValueError if the csv does not have the right format
+        mapping_df = pd.read_csv(csv_path, dtype={'texhash': str})
+        if 'texhash' not in mapping_df or 'cardname' not in mapping_df:
+            raise ValueError('%s does not have the right format' % csv_path)
+        self.replace_mappings(mapping_df)
+
+    def export_csv(self, csv_path):
+        mapping.csv_frame(self.load_mapping()).to_csv(csv_path, index=False)
+
+    def save_textures(self, tex_df, hashes=None):
+        # Brings the textures table to tex_df. Rows are told apart by a hash
+        # of their KEY_COLUMNS and compared by a hash of every column, only
+        # the rows which are gone or changed are written, relpaths are only
+        # built for those. The first save of a session replaces the table
+        # unless its fingerprint shows it already holds tex_df.
+        # hashes is texture_hashes(tex_df) if it was already computed.
+        key_hashes, row_hashes = hashes if hashes is not None else texture_hashes(tex_df)
+        fingerprint = '%d:%d' % (len(tex_df), int(row_hashes.sum()))
+
+        if self.saved is None:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'textures'").fetchone()
+            if row is None or row[0] != fingerprint:
+                with self.conn:
+                    self.conn.execute('DELETE FROM textures')
+                    self.insert_textures(tex_df)
+                    self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('textures', ?)", (fingerprint,))
+            self.saved = (tex_df, key_hashes, row_hashes)
+            return
+
+        saved_df, saved_keys, saved_rows = self.saved
+        gone = np.flatnonzero(~np.isin(saved_keys, key_hashes))
+        changed = np.flatnonzero(~np.isin(row_hashes, saved_rows))
+        if len(gone) or len(changed):
+            with self.conn:
+                self.conn.executemany(
+                    'DELETE FROM textures WHERE relpath = ?',
+                    ((relpath,) for relpath in scanner.tex_relpaths(saved_df.iloc[gone]))
+                )
+                self.insert_textures(tex_df.iloc[changed])
+                self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('textures', ?)", (fingerprint,))
+        self.saved = (tex_df, key_hashes, row_hashes)
+
+    def insert_textures(self, tex_df):
+        df = tex_df[list(TEXTURE_COLUMNS)].astype(object)
+        df.insert(0, 'hex', scanner.tex_hexes(tex_df))
+        df.insert(0, 'relpath', scanner.tex_relpaths(tex_df))
+        df = df.where(df.notna(), None)
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO textures VALUES (%s)' % ', '.join('?' * len(df.columns)),
+            df.itertuples(index=False)
+        )
+
+    def load_options(self):
+        return {key: json.loads(value) for key, value in self.conn.execute('SELECT key, value FROM options')}
+
+    def save_options(self, options):
+        # Writes the options which changed since the last save
+        changed = {key: value for key, value in options.items() if key not in self.options or self.options[key] != value}
+        gone = [key for key in self.options if key not in options]
+        if not changed and not gone:
+            return
+        with self.conn:
+            self.conn.executemany('DELETE FROM options WHERE key = ?', ((key,) for key in gone))
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO options VALUES (?, ?)',
+                ((key, json.dumps(value)) for key, value in changed.items())
+            )
+        self.options = json.loads(json.dumps(options))
@@ -0,0 +1,229 @@
+import os
+import sys
+import re
+import json
+import argparse
+
+#   Headless entry point, run as `wstone <command>`. Shares data.json,
+#   final.csv (or the catalog) and the manifests with the GUI and writes
+#   JSON Lines to stdout, one object per texture, group or move. Must not
+#   import tkinter, wstone.py dispatches here before it does.
+
+def application_path():
+    if getattr(sys, 'frozen', False):
+        return os.path.dirname(sys.executable)
+    return os.path.dirname(os.path.abspath(__file__))
+
+def emit(obj):
+    sys.stdout.write(json.dumps(obj, ensure_ascii=False) + '\n')
+
+def emit_textures(tex_df):
+    import scanner
+
+    for row, relpath in zip(tex_df.itertuples(index=False), scanner.tex_relpaths(tex_df)):
+        emit(texture_record(row, relpath))
+
+def texture_record(row, relpath):
+    import scanner
+
+    return {
+        'relpath': relpath,
+        'hex': scanner.tex_hex_of(relpath),
+        'id': row.tex_id if isinstance(row.tex_id, str) else None,
+        'width': int(row.tex_width),
+        'height': int(row.tex_height),
+        'format': row.tex_format,
+        'mips': int(row.tex_mips),
+        'size': int(row.tex_size),
+        'vram': int(row.tex_vram)
+    }
+
+class Session:
+
+    #   What MainWindow.load_worker sets up, without Tk:
+    #   app_path is the directory holding data.json, csv/final.csv and the caches
+    #   data is data.json, the texture directories are its active ones
+    #   unless given, relpaths are relative to base, their common directory
+    #   catalog is the Catalog if the use_catalog option is on
+
+    def __init__(self, args):
+        import pandas as pd
+        import mapping
+
+        self.app_path = args.app_path or application_path()
+        self.data = {}
+        try:
+            with open(os.path.join(self.app_path, 'data.json'), encoding='utf-8') as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            pass
+        self.options = self.data.get('options', {})
+        self.tex_dirs = args.tex_dir or self.data.get('active_tex_dirs') or [self.data.get('tex_dir', '')]
+        self.workers = args.workers or self.options.get('scan_workers', 8)
+
+        self.mapping_df_path = os.path.join(self.app_path, 'csv', 'final.csv')
+        self.mapping_cache_path = os.path.join(self.app_path, 'mapping.cache')
+        self.manifest_dir = os.path.join(self.app_path, 'manifests')
+        self.remap_journal_path = os.path.join(self.app_path, 'remap.journal')
+        self.build_state_path = os.path.join(self.app_path, 'build.state')
+
+        self.catalog = None
+        if self.options.get('use_catalog'):
+            import catalog
+            self.catalog = catalog.Catalog(os.path.join(self.app_path, 'catalog.sqlite'))
+            if self.catalog.is_empty() and os.path.isfile(self.mapping_df_path):
+                self.catalog.import_csv(self.mapping_df_path)
+            self.mapping_df = self.catalog.load_mapping()
+            self.mapping_key = self.catalog.mapping_key()
+        else:
+            try:
+                self.mapping_df = mapping.load_mapping(self.mapping_df_path, self.mapping_cache_path)
+            except ValueError as e:
+                sys.stderr.write('wstone: %s, ids are not resolved\n' % e)
+                self.mapping_df = pd.DataFrame(columns=mapping.MAPPING_COLUMNS)
+            self.mapping_key = mapping.mapping_key(self.mapping_df_path)
+        self.mapping_index = mapping.build_texhash_index(self.mapping_df)
+        self.library = None
+        self.base = ''
+
+    def scan(self):
+        import library
+
+        for tex_dir in self.tex_dirs:
+            if not tex_dir or not os.path.isdir(tex_dir):
+                raise ValueError('texture directory %r does not exist' % tex_dir)
+        self.library = library.Library(self.manifest_dir, self.workers)
+        self.library.set_roots(self.tex_dirs)
+        self.base = self.library.base
+        tex_df = self.library.scan(self.mapping_index, self.mapping_key)
+        if self.catalog:
+            self.catalog.save_textures(tex_df)
+        return tex_df
+
+def cmd_scan(session, args):
+    emit_textures(session.scan())
+
+def cmd_search(session, args):
+    import search
+
+    tex_df = session.scan()
+    if args.mode == 'regex':
+        result = search.regex(tex_df, args.query)
+    elif args.mode == 'fuzzy':
+        result = tex_df.iloc[search.SearchIndex(tex_df, session.mapping_df).fuzzy(args.query)]
+    else:
+        result = tex_df.iloc[search.SearchIndex(tex_df, session.mapping_df).prefix(args.query)]
+    emit_textures(result)
+
+def cmd_dupes(session, args):
+    import dupes
+
+    tex_df = session.scan()
+    records = dict(session.library.records())
+    if args.similar:
+        threshold = args.threshold if args.threshold is not None else session.options.get('similar_threshold', dupes.DEFAULT_SIMILAR_THRESHOLD)
+        if not 0 <= threshold <= dupes.MAX_SIMILAR_THRESHOLD:
+            raise ValueError('--threshold must be between 0 and %d' % dupes.MAX_SIMILAR_THRESHOLD)
+        groups = dupes.find_similar(session.base, tex_df, records, threshold)
+    else:
+        groups = dupes.find_duplicates(session.base, tex_df, records, session.workers)
+    # Keep the hashes for the next run
+    session.library.save_manifests(records)
+    for group in groups:
+        emit(group)
+
+def cmd_remap(session, args):
+    import mapping
+    import remap
+
+    # Checked first, so no rename lines are emitted for a remap which is
+    # not going to run
+    if not args.dry_run and remap.load_journal(session.remap_journal_path) is not None:
+        raise ValueError('an interrupted remap has to be finished or undone in the GUI first')
+    tex_df = session.scan()
+    new_mapping_df = remap.read_mapping(args.csv)
+    plan = remap.RemapPlan(session.base, tex_df, session.mapping_df, new_mapping_df)
+    for src, dst in zip(plan.moves['src'], plan.moves['dst']):
+        emit({'action': 'rename', 'src': src, 'dst': dst})
+    for src, dst, reason in zip(plan.skipped['src'], plan.skipped['dst'], plan.skipped['reason']):
+        emit({'action': 'skip', 'src': src, 'dst': dst, 'reason': reason})
+    summary = {
+        'action': 'summary',
+        'rename': len(plan.moves),
+        'unchanged': plan.unchanged,
+        'skipped': len(plan.skipped),
+        'ambiguous': sorted(plan.ambiguous),
+        'dry_run': args.dry_run
+    }
+
+    if not args.dry_run:
+        remap.execute(plan, session.remap_journal_path, os.path.abspath(args.csv))
+        if session.catalog:
+            session.catalog.replace_mappings(new_mapping_df)
+        else:
+            mapping.save_mapping(new_mapping_df, session.mapping_df_path, session.mapping_cache_path)
+        remap.remove_journal(session.remap_journal_path)
+    emit(summary)
+
+def cmd_build(session, args):
+    import mapping
+    import builder
+
+    mapping_df, report = builder.build(os.path.dirname(session.mapping_df_path), session.build_state_path)
+    if session.catalog:
+        session.catalog.replace_mappings(mapping_df)
+    else:
+        mapping.save_mapping(mapping_df, session.mapping_df_path, session.mapping_cache_path)
+    emit(dict(report, rows=len(mapping_df)))
+
+def cmd_stats(session, args):
+    import scanner
+
+    emit(scanner.directory_stats(session.scan()))
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='wstone', description='Run WStone Tracker without a window. Output is JSON Lines.')
+    parser.add_argument('--tex-dir', action='append', help='texture directory, can be repeated, defaults to the ones active in the GUI')
+    parser.add_argument('--app-path', help='directory holding data.json and csv/final.csv')
+    parser.add_argument('--workers', type=int, help='scan threads')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('scan', help='list every texture')
+    p.set_defaults(func=cmd_scan)
+
+    p = commands.add_parser('search', help='list textures matching a query')
+    p.add_argument('query')
+    p.add_argument('--mode', choices=['prefix', 'regex', 'fuzzy'], default='prefix')
+    p.set_defaults(func=cmd_search)
+
+    p = commands.add_parser('dupes', help='list groups of duplicate textures')
+    p.add_argument('--similar', action='store_true', help='find perceptually similar textures instead')
+    p.add_argument('--threshold', type=int, help='maximum differing bits for --similar')
+    p.set_defaults(func=cmd_dupes)
+
+    p = commands.add_parser('remap', help='rename textures for a new final.csv')
+    p.add_argument('csv', help='the new final.csv')
+    p.add_argument('--dry-run', action='store_true', help='only print the plan')
+    p.set_defaults(func=cmd_remap)
+
+    p = commands.add_parser('build', help='rebuild final.csv from the source tables in csv/')
+    p.set_defaults(func=cmd_build)
+
+    p = commands.add_parser('stats', help='print directory statistics')
+    p.set_defaults(func=cmd_stats)
+    return parser
+
+def main(argv):
+    args = build_parser().parse_args(argv)
+    try:
+        session = Session(args)
+        args.func(session, args)
+    except BrokenPipeError:
+        # Output piped into head and the like, keep the interpreter from
+        # failing to flush stdout on exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
+    except (OSError, ValueError, re.error) as e:
+        sys.stderr.write('wstone: %s\n' % e)
+        return 1
+    return 0
@@ -0,0 +1,172 @@
+import mmap
+import struct
+from collections import namedtuple
+from PIL import Image
+
+#   Minimal DDS reader. Parses the 128 byte header (148 with the DX10
+#   extension) and decodes single mip levels straight from a memory map,
+#   so a preview never has to decode the full resolution surface.
+
+DDS_MAGIC = b'DDS '
+HEADER_SIZE = 128
+DX10_HEADER_SIZE = 148
+
+DDSD_MIPMAPCOUNT = 0x20000
+DDPF_ALPHAPIXELS = 0x1
+DDPF_FOURCC = 0x4
+DDPF_RGB = 0x40
+DDPF_LUMINANCE = 0x20000
+
+#   format name -> (mode, decoder, decoder args, bytes per 4x4 block or per pixel, is block compressed)
+FORMATS = {
+    'DXT1': ('RGBA', 'bcn', (1, 'DXT1'), 8, True),
+    'DXT3': ('RGBA', 'bcn', (2, 'DXT3'), 16, True),
+    'DXT5': ('RGBA', 'bcn', (3, 'DXT5'), 16, True),
+    'BC4': ('L', 'bcn', (4, 'BC4'), 8, True),
+    'BC5': ('RGB', 'bcn', (5, 'BC5'), 16, True),
+    'BC5S': ('RGB', 'bcn', (5, 'BC5S'), 16, True),
+    'BC6H': ('RGB', 'bcn', (6, 'BC6H'), 16, True),
+    'BC6HS': ('RGB', 'bcn', (6, 'BC6HS'), 16, True),
+    'BC7': ('RGBA', 'bcn', (7, 'BC7'), 16, True),
+    'RGBA8': ('RGBA', 'raw', ('RGBA', 0, 1), 4, False),
+    'BGRA8': ('RGBA', 'raw', ('BGRA', 0, 1), 4, False),
+    'BGRX8': ('RGB', 'raw', ('BGRX', 0, 1), 4, False),
+    'BGR8': ('RGB', 'raw', ('BGR', 0, 1), 3, False),
+    'L8': ('L', 'raw', ('L', 0, 1), 1, False),
+}
+
+FOURCC_FORMATS = {
+    b'DXT1': 'DXT1',
+    b'DXT2': 'DXT3',
+    b'DXT3': 'DXT3',
+    b'DXT4': 'DXT5',
+    b'DXT5': 'DXT5',
+    b'ATI1': 'BC4',
+    b'BC4U': 'BC4',
+    b'ATI2': 'BC5',
+    b'BC5U': 'BC5',
+    b'BC5S': 'BC5S',
+}
+
+DXGI_FORMATS = {
+    27: 'RGBA8', 28: 'RGBA8', 29: 'RGBA8',
+    70: 'DXT1', 71: 'DXT1', 72: 'DXT1',
+    73: 'DXT3', 74: 'DXT3', 75: 'DXT3',
+    76: 'DXT5', 77: 'DXT5', 78: 'DXT5',
+    79: 'BC4', 80: 'BC4',
+    82: 'BC5', 83: 'BC5', 84: 'BC5S',
+    87: 'BGRA8', 88: 'BGRX8', 90: 'BGRA8', 91: 'BGRA8', 92: 'BGRX8', 93: 'BGRX8',
+    94: 'BC6H', 95: 'BC6H', 96: 'BC6HS',
+    97: 'BC7', 98: 'BC7', 99: 'BC7',
+}
+
+#   width, height - size of the top level
+#   mips - number of mip levels, at least 1
+#   format - key of FORMATS, or a description of an unsupported format
+#   data_offset - offset of the top level from the start of the file
+#   depth - depth of volume textures, 1 otherwise
+DdsInfo = namedtuple('DdsInfo', ['width', 'height', 'mips', 'format', 'data_offset', 'depth'])
+
+def parse_header(header):
+    # header is the first HEADER_SIZE (or DX10_HEADER_SIZE) bytes of a file.
+    # Raises ValueError if it is not a DDS header.
+    if len(header) < HEADER_SIZE or header[:4] != DDS_MAGIC:
+        raise ValueError('not a DDS file')
+
+    size, flags, height, width, pitch, depth, mips = struct.unpack_from('<7I', header, 4)
+    if size != 124:
+        raise ValueError('unsupported DDS header size %d' % size)
+    pf_flags, fourcc, bitcount, rmask, gmask, bmask, amask = struct.unpack_from('<I4s5I', header, 80)
+
+    data_offset = HEADER_SIZE
+    if pf_flags & DDPF_FOURCC:
+        if fourcc == b'DX10':
+            if len(header) < DX10_HEADER_SIZE:
+                raise ValueError('truncated DX10 header')
+            dxgi_format, = struct.unpack_from('<I', header, HEADER_SIZE)
+            fmt = DXGI_FORMATS.get(dxgi_format, 'DXGI %d' % dxgi_format)
+            data_offset = DX10_HEADER_SIZE
+        else:
+            fmt = FOURCC_FORMATS.get(fourcc, fourcc.decode('latin-1'))
+    elif pf_flags & DDPF_RGB:
+        fmt = rgb_format(bitcount, rmask, gmask, bmask, amask if pf_flags & DDPF_ALPHAPIXELS else 0)
+    elif pf_flags & DDPF_LUMINANCE and bitcount == 8:
+        fmt = 'L8'
+    else:
+        fmt = 'unknown'
+
+    if not flags & DDSD_MIPMAPCOUNT:
+        mips = 1
+    return DdsInfo(width, height, max(1, mips), fmt, data_offset, max(1, depth))
+
+def rgb_format(bitcount, rmask, gmask, bmask, amask):
+    masks = (rmask, gmask, bmask, amask)
+    if bitcount == 32 and masks == (0xFF, 0xFF00, 0xFF0000, 0xFF000000):
+        return 'RGBA8'
+    if bitcount == 32 and masks == (0xFF0000, 0xFF00, 0xFF, 0xFF000000):
+        return 'BGRA8'
+    if bitcount == 32 and masks == (0xFF0000, 0xFF00, 0xFF, 0):
+        return 'BGRX8'
+    if bitcount == 24 and masks == (0xFF0000, 0xFF00, 0xFF, 0):
+        return 'BGR8'
+    return 'RGB%d' % bitcount
+
+def read_info(path):
+    with open(path, 'rb') as f:
+        return parse_header(f.read(DX10_HEADER_SIZE))
+
+def level_size(fmt, width, height):
+    mode, decoder, args, unit, compressed = FORMATS[fmt]
+    if compressed:
+        return max(1, (width + 3) // 4) * max(1, (height + 3) // 4) * unit
+    return width * height * unit
+
+def levels(info):
+    # Yields (level, width, height, offset, size) for every mip level
+    offset = info.data_offset
+    width, height = info.width, info.height
+    for level in range(info.mips):
+        size = level_size(info.format, width, height)
+        yield level, width, height, offset, size
+        offset += size
+        width, height = max(1, width // 2), max(1, height // 2)
+
+def surface_size(info):
+    # Bytes of the whole mip chain, or None for formats FORMATS does not know
+    if info.format not in FORMATS:
+        return None
+    return sum(size for level, width, height, offset, size in levels(info))
+
+def pick_level(info, min_size):
+    # The smallest level which is still at least min_size, or the top level
+    # if the texture itself is smaller
+    chosen = None
+    for level in levels(info):
+        if level[1] < min_size[0] or level[2] < min_size[1]:
+            break
+        chosen = level
+    return chosen or next(levels(info))
+
+def open_level(path, min_size):
+    # Decodes the smallest mip level of path which covers min_size. Returns
+    # None if the format is not supported here, so the caller can fall back
+    # to Image.open.
+    with open(path, 'rb') as f:
+        try:
+            info = parse_header(f.read(DX10_HEADER_SIZE))
+        except ValueError:
+            return None
+        if info.format not in FORMATS or info.depth > 1:
+            return None
+
+        level, width, height, offset, size = pick_level(info, min_size)
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if offset + size > len(mm):
+                    return None
+                data = mm[offset:offset + size]
+        except (OSError, ValueError):
+            return None
+
+    mode, decoder, args, unit, compressed = FORMATS[info.format]
+    return Image.frombytes(mode, (width, height), data, decoder, args)
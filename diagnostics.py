@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import functools
+import threading
+from collections import deque
+
+#   Timing spans and counters for the hot paths, shown in Options >
+#   Diagnostics. A span costs two perf_counter calls and a deque append, so
+#   they are always on. cProfile only runs between start_profile and
+#   stop_profile.
+#   events holds the last MAX_EVENTS spans as (name, start, duration, thread)
+#   in seconds, start relative to STARTED
+#   totals maps span name -> [count, total seconds, max seconds], over all spans
+#   counters maps counter name -> value
+
+MAX_EVENTS = 20000
+STARTED = time.perf_counter()
+
+lock = threading.Lock()
+events = deque(maxlen=MAX_EVENTS)
+totals = {}
+counters = {}
+profiler = None
+
+class span:
+
+    #   with diagnostics.span('scan'): ...
+    #   Also usable as a decorator.
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        record(self.name, self.start, end - self.start)
+        return False
+
+    def __call__(self, func):
+        name = self.name
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+def record(name, start, duration):
+    with lock:
+        events.append((name, start - STARTED, duration, threading.get_ident()))
+        total = totals.get(name)
+        if total is None:
+            totals[name] = [1, duration, duration]
+        else:
+            total[0] += 1
+            total[1] += duration
+            if duration > total[2]:
+                total[2] = duration
+
+def count(name, n=1):
+    with lock:
+        counters[name] = counters.get(name, 0) + n
+
+def reset():
+    with lock:
+        events.clear()
+        totals.clear()
+        counters.clear()
+
+def summary():
+    # Returns ({span name: {count, total_ms, mean_ms, max_ms}}, counters)
+    with lock:
+        spans = {
+            name: {
+                'count': n,
+                'total_ms': round(total * 1000, 3),
+                'mean_ms': round(total * 1000 / n, 3),
+                'max_ms': round(longest * 1000, 3)
+            }
+            for name, (n, total, longest) in totals.items()
+        }
+        return spans, dict(counters)
+
+def export_json(path):
+    spans, values = summary()
+    with lock:
+        recent = [
+            {'name': name, 'start_ms': round(start * 1000, 3), 'ms': round(duration * 1000, 3), 'thread': thread}
+            for name, start, duration, thread in events
+        ]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'spans': spans, 'counters': values, 'events': recent}, f, indent=4)
+
+def export_chrome_trace(path):
+    # Trace Event Format, opens in chrome://tracing and Perfetto
+    pid = os.getpid()
+    with lock:
+        trace = [
+            {'name': name, 'ph': 'X', 'ts': start * 1e6, 'dur': duration * 1e6, 'pid': pid, 'tid': thread}
+            for name, start, duration, thread in events
+        ]
+        trace.extend(
+            {'name': name, 'ph': 'C', 'ts': (time.perf_counter() - STARTED) * 1e6, 'pid': pid, 'args': {name: value}}
+            for name, value in counters.items()
+        )
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+def start_profile():
+    # Profiles the calling thread, the Tk thread when started from the
+    # Diagnostics window
+    global profiler
+    import cProfile
+
+    if profiler is None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+def stop_profile():
+    # Returns the pstats.Stats of the capture, or None if none was running
+    global profiler
+    import pstats
+
+    if profiler is None:
+        return None
+    profiler.disable()
+    stats = pstats.Stats(profiler)
+    profiler = None
+    return stats
+
+def profiling():
+    return profiler is not None
@@ -0,0 +1,275 @@
+import os
+import hashlib
+import itertools
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+import diagnostics
+import scanner
+
+#   Duplicate detection over tex_df. Files are bucketed by size, then by a
+#   hash of their first and last SAMPLE_SIZE bytes (of the whole file if it
+#   is not larger than 2 * SAMPLE_SIZE), and only files which still collide
+#   get a full streaming hash. Hashes are kept in the scanner manifest
+#   records (sample, hash) and reused while size and mtime match.
+
+SAMPLE_SIZE = 64 * 1024
+CHUNK_SIZE = 1024 * 1024
+DEFAULT_WORKERS = 8
+
+def sample_hash(path, size):
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        if size <= 2 * SAMPLE_SIZE:
+            h.update(f.read())
+        else:
+            h.update(f.read(SAMPLE_SIZE))
+            f.seek(size - SAMPLE_SIZE)
+            h.update(f.read(SAMPLE_SIZE))
+    return h.hexdigest()
+
+def full_hash(path):
+    h = hashlib.blake2b(digest_size=32)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def cached_hash(path, record, field, compute):
+    # record is the manifest record of path. The file is stat'ed again since
+    # the scanner does not stat files in directories whose mtime is unchanged,
+    # a file which changed since the scan is hashed but not cached.
+    st = os.stat(path)
+    if record.get('size') != st.st_size or record.get('mtime') != st.st_mtime_ns:
+        return compute()
+    if field not in record:
+        record[field] = compute()
+    return record[field]
+
+def hash_all(tex_dir, jobs, records, field, executor, progress, done, total):
+    # jobs is a list of (relpath, compute), compute is called with the full
+    # path. Returns {relpath: hash}, files which cannot be read are left out.
+    futures = {}
+    for rp, compute in jobs:
+        path = os.path.join(tex_dir, rp)
+        futures[executor.submit(cached_hash, path, records[rp], field, lambda path=path, compute=compute: compute(path))] = rp
+
+    hashes = {}
+    for future in as_completed(futures):
+        done[0] += 1
+        if progress:
+            progress(done[0], total)
+        try:
+            hashes[futures[future]] = future.result()
+        except OSError:
+            continue
+    return hashes
+
+def group_by(hashes):
+    groups = {}
+    for rp, key in hashes.items():
+        groups.setdefault(key, []).append(rp)
+    return groups
+
+@diagnostics.span('find_duplicates')
+def find_duplicates(tex_dir, tex_df, records=None, workers=DEFAULT_WORKERS, progress=None):
+    # Returns a list of groups, each a dict with:
+    #   kind - 'content' for identical files, 'hex' for files sharing tex_hex
+    #   key - the content hash or the hex
+    #   relpaths - sorted relpaths of the group, at least two
+    # records maps relpath -> manifest record, see TextureScanner.records.
+    # progress is called as progress(done, total) from the calling thread.
+    if records is None:
+        records = {}
+    relpaths = scanner.tex_relpaths(tex_df)
+    records = {rp: records.get(rp, {}) for rp in relpaths}
+
+    sizes = tex_df['tex_size'].to_numpy(dtype='int64')
+    shared = (sizes > 0) & tex_df['tex_size'].duplicated(keep=False).to_numpy()
+    size_of = {rp: int(size) for rp, size, s in zip(relpaths, sizes, shared) if s}
+
+    total = len(size_of)
+    done = [0]
+    content = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        jobs = [(rp, lambda path, size=size: sample_hash(path, size)) for rp, size in size_of.items()]
+        samples = hash_all(tex_dir, jobs, records, 'sample', executor, progress, done, total)
+
+        hashes = {}
+        survivors = []
+        for key, group in group_by({rp: (size_of[rp], h) for rp, h in samples.items()}).items():
+            if len(group) < 2:
+                continue
+            if key[0] <= 2 * SAMPLE_SIZE:
+                # The sample already covers the whole file
+                hashes['%d:%s' % key] = group
+            else:
+                survivors.extend(group)
+
+        total += len(survivors)
+        jobs = [(rp, full_hash) for rp in survivors]
+        hashes.update(group_by(hash_all(tex_dir, jobs, records, 'hash', executor, progress, done, total)))
+
+    for key, relpaths in hashes.items():
+        if len(relpaths) > 1:
+            content.append({'kind': 'content', 'key': key, 'relpaths': sorted(relpaths)})
+
+    # Same hex, unless all of them are already one content group
+    in_content = {}
+    for group in content:
+        for rp in group['relpaths']:
+            in_content[rp] = group['key']
+
+    same_hex = []
+    by_hex = group_by(dict(zip(relpaths, scanner.tex_hexes(tex_df))))
+    for key in sorted(by_hex):
+        group = sorted(by_hex[key])
+        if len(group) > 1 and len({in_content.get(rp, rp) for rp in group}) > 1:
+            same_hex.append({'kind': 'hex', 'key': key, 'relpaths': group})
+
+    content.sort(key=lambda group: group['relpaths'][0])
+    return content + same_hex
+
+#   Near duplicates: a 64 bit difference hash (dHash) of every texture is
+#   computed from a small mip level and cached as 'dhash' in the manifest
+#   records. Pairs within a Hamming distance are found through a multi-index
+#   hash: two hashes within t bits agree on one of their four 16 bit chunks
+#   up to t // 4 bits, so only hashes sharing such a chunk are compared.
+
+DEFAULT_SIMILAR_THRESHOLD = 6
+
+#   Largest threshold offered. The chunk radius is threshold // 4, so 8 to
+#   11 bits cost the same (about 2 s on 40000 hashes) while 12 bits already
+#   takes about 10 s.
+MAX_SIMILAR_THRESHOLD = 11
+HASH_CHUNKS = 4
+CHUNK_BITS = 16
+
+#   Number of set bits of every byte value
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def perceptual_hash(path):
+    # Runs in a worker process. Returns None if the file cannot be decoded.
+    from PIL import Image
+    import dds
+
+    try:
+        im = dds.open_level(path, (9, 8))
+        if im is None:
+            im = Image.open(path)
+        im = im.convert('L').resize((9, 8), Image.BILINEAR)
+    except Exception:
+        # Anything else raised here would surface from executor.map and
+        # abort the whole search
+        return None
+
+    pixels = list(im.getdata())
+    value = 0
+    for y in range(8):
+        for x in range(8):
+            value = (value << 1) | (pixels[y * 9 + x] > pixels[y * 9 + x + 1])
+    return value
+
+def hamming(a, b):
+    # a and b are uint64 arrays, returns the bit distance of every pair
+    return POPCOUNT[(a ^ b).view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+def chunk_masks(radius):
+    # Every CHUNK_BITS wide mask with at most radius bits set
+    masks = [0]
+    for r in range(1, radius + 1):
+        for bits in itertools.combinations(range(CHUNK_BITS), r):
+            masks.append(sum(1 << b for b in bits))
+    return masks
+
+def near_pairs(values, threshold):
+    # values is an array of distinct uint64 hashes. Returns the arrays (i, j)
+    # of every pair of positions i < j within threshold bits.
+    n = len(values)
+    masks = chunk_masks(threshold // HASH_CHUNKS)
+    positions = np.arange(n)
+    found = []
+
+    for c in range(HASH_CHUNKS):
+        part = ((values >> np.uint64(c * CHUNK_BITS)) & np.uint64(0xffff)).astype(np.int64)
+        order = np.argsort(part, kind='stable')
+        counts = np.bincount(part, minlength=1 << CHUNK_BITS)
+        starts = np.cumsum(counts) - counts
+
+        for mask in masks:
+            q = part ^ mask
+            q_counts = counts[q]
+            total = int(q_counts.sum())
+            if not total:
+                continue
+            i = np.repeat(positions, q_counts)
+            offsets = np.arange(total) - np.repeat(np.cumsum(q_counts) - q_counts, q_counts)
+            j = order[np.repeat(starts[q], q_counts) + offsets]
+            keep = i < j
+            i, j = i[keep], j[keep]
+            # Drop pairs that are too far apart right away, the candidates
+            # of all masks together grow far faster than the matches
+            close = hamming(values[i], values[j]) <= threshold
+            found.append(i[close] * n + j[close])
+
+    if not found:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    pairs = np.unique(np.concatenate(found))
+    return pairs // n, pairs % n
+
+@diagnostics.span('find_similar')
+def find_similar(tex_dir, tex_df, records=None, threshold=DEFAULT_SIMILAR_THRESHOLD, workers=None, progress=None):
+    # Returns groups like find_duplicates with kind 'similar'. Each group is
+    # one texture and every not yet grouped texture within threshold bits of
+    # it, so groups do not chain into each other.
+    # progress is called as progress(done, total) from the calling thread.
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    if records is None:
+        records = {}
+
+    hashes = {}
+    jobs = []
+    for rp in scanner.tex_relpaths(tex_df):
+        record = records.get(rp, {})
+        try:
+            st = os.stat(os.path.join(tex_dir, rp))
+        except OSError:
+            continue
+        if 'dhash' in record and record.get('size') == st.st_size and record.get('mtime') == st.st_mtime_ns:
+            hashes[rp] = record['dhash']
+        else:
+            jobs.append(rp)
+
+    if jobs:
+        # Not forked, the calling process may hold locks in other threads
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            paths = [os.path.join(tex_dir, rp) for rp in jobs]
+            for done, (rp, value) in enumerate(zip(jobs, executor.map(perceptual_hash, paths, chunksize=64)), 1):
+                hashes[rp] = value
+                if rp in records:
+                    records[rp]['dhash'] = value
+                if progress:
+                    progress(done, len(jobs))
+
+    # Flat textures all hash to 0 and would form one huge group
+    by_value = group_by({rp: value for rp, value in hashes.items() if value})
+    values = sorted(by_value, key=lambda value: min(by_value[value]))
+    i, j = near_pairs(np.array(values, dtype=np.uint64), threshold)
+
+    neighbours = {}
+    for a, b in zip(i.tolist(), j.tolist()):
+        neighbours.setdefault(a, []).append(b)
+        neighbours.setdefault(b, []).append(a)
+
+    similar = []
+    grouped = set()
+    for leader, value in enumerate(values):
+        if leader in grouped:
+            continue
+        members = [leader] + [k for k in neighbours.get(leader, ()) if k not in grouped]
+        relpaths = sorted(rp for k in members for rp in by_value[values[k]])
+        if len(relpaths) > 1:
+            grouped.update(members)
+            similar.append({'kind': 'similar', 'key': '%016x' % value, 'relpaths': relpaths})
+    return similar
@@ -0,0 +1,151 @@
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import pandas as pd
+import diagnostics
+import scanner
+
+#   A library is the merged view of several texture directories (roots).
+#   Every root has its own TextureScanner and manifest, roots are scanned
+#   concurrently and their tex_dfs are concatenated with a tex_root column
+#   and sorted by relpath, like the tex_df of a single root. tex_dir of the
+#   merged rows is relative to base, the deepest directory holding every
+#   root, so (base, relpath) works wherever (tex_dir, relpath) did. With a
+#   single root base is that root and the merged tex_df only gains tex_root.
+#   Scanners are kept when the roots change, a root which comes back is
+#   taken from memory instead of being walked again.
+
+def manifest_name(root):
+    return 'manifest-%s.json' % hashlib.sha1(root.encode('utf-8')).hexdigest()[:16]
+
+def common_base(roots):
+    # '' if the roots have nothing in common, like different drives, the
+    # relpaths are then absolute paths
+    if len(roots) == 1:
+        return roots[0]
+    try:
+        return os.path.commonpath(roots)
+    except ValueError:
+        return ''
+
+class Library:
+
+    #   manifest_dir is the directory holding the manifest of every root
+    #   workers is the number of scan threads of every root
+    #   roots is the list of active roots, base is their common directory
+    #   scanners maps root -> TextureScanner, for inactive roots too
+    #   tex_df is the merged dataframe of the active roots
+
+    def __init__(self, manifest_dir, workers=scanner.DEFAULT_WORKERS):
+        self.manifest_dir = manifest_dir
+        self.workers = workers
+        self.roots = []
+        self.base = ''
+        self.scanners = {}
+        self.tex_df = None
+
+    def set_roots(self, roots):
+        # Raises ValueError if a root is inside another one
+        roots = list(dict.fromkeys(os.path.abspath(root) for root in roots))
+        for root in roots:
+            for other in roots:
+                if root != other and os.path.join(root, '').startswith(os.path.join(other, '')):
+                    raise ValueError('%s is inside %s' % (root, other))
+        self.roots = roots
+        self.base = common_base(roots) if roots else ''
+
+    def prefix(self, root):
+        # Path of root relative to base
+        if not self.base:
+            return root
+        return '' if root == self.base else os.path.relpath(root, self.base)
+
+    def scanner(self, root):
+        texture_scanner = self.scanners.get(root)
+        if texture_scanner is None:
+            path = os.path.join(self.manifest_dir, manifest_name(root))
+            texture_scanner = scanner.TextureScanner(root, path, self.workers)
+            self.scanners[root] = texture_scanner
+        texture_scanner.workers = max(1, self.workers)
+        return texture_scanner
+
+    def scan(self, texhash_index, mapping_key, progress=None, walk=True):
+        # Scans the active roots concurrently and returns the merged tex_df.
+        # With walk False, roots which were scanned before are not walked,
+        # only their ids are resolved again if the mapping changed.
+        # progress is called as progress(dirs_seen, files_seen) over all
+        # roots from the calling thread.
+        try:
+            os.makedirs(self.manifest_dir, exist_ok=True)
+        except OSError:
+            # The scanners report it when they cannot save their manifests
+            pass
+        seen = {}
+
+        def scan_root(root):
+            texture_scanner = self.scanner(root)
+            if not walk and texture_scanner.tex_df is not None:
+                texture_scanner.update(texture_scanner.dirs, set(), texhash_index, mapping_key)
+            else:
+                texture_scanner.scan(texhash_index, mapping_key, lambda dirs, files: seen.__setitem__(root, (dirs, files)))
+
+        with ThreadPoolExecutor(max_workers=max(1, len(self.roots))) as executor:
+            pending = {executor.submit(scan_root, root) for root in self.roots}
+            while pending:
+                done, pending = wait(pending, timeout=0.05, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+                if progress:
+                    counts = list(seen.values())
+                    progress(sum(c[0] for c in counts), sum(c[1] for c in counts))
+        return self.merge()
+
+    def refresh(self, changes, texhash_index, mapping_key):
+        # changes maps root -> (full, rels) as reported by its watcher
+        for root, (full, rels) in changes.items():
+            if root not in self.roots:
+                continue
+            if full:
+                self.scanner(root).scan(texhash_index, mapping_key)
+            else:
+                self.scanner(root).refresh(rels, texhash_index, mapping_key)
+        return self.merge()
+
+    @diagnostics.span('library_merge')
+    def merge(self):
+        frames = []
+        for root in self.roots:
+            tex_df = self.scanners[root].tex_df
+            prefix = self.prefix(root)
+            if prefix:
+                tex_dir = tex_df['tex_dir'].cat.rename_categories(lambda d: os.path.join(prefix, d) if d else prefix)
+                tex_df = tex_df.assign(tex_dir=tex_dir)
+            frames.append(tex_df.assign(tex_root=root))
+
+        if not frames:
+            tex_df = scanner.empty_tex_df().assign(tex_root=None)
+        elif len(frames) == 1:
+            tex_df = frames[0]
+        else:
+            tex_df = pd.concat(frames, ignore_index=True)
+            relpaths = scanner.tex_relpaths(tex_df)
+            order = sorted(range(len(relpaths)), key=relpaths.__getitem__)
+            tex_df = tex_df.iloc[order].reset_index(drop=True)
+        self.tex_df = tex_df.astype(dict(scanner.TEX_DTYPES, tex_root='category'))
+        return self.tex_df
+
+    def records(self):
+        # (relpath from base, manifest record) of every active texture
+        records = []
+        for root in self.roots:
+            prefix = self.prefix(root)
+            for relpath, record in self.scanners[root].records():
+                records.append((os.path.join(prefix, relpath) if prefix else relpath, record))
+        return records
+
+    def save_manifests(self, records):
+        # Keeps the values added to the dicts of records(), like hashes
+        # cached by dupes, records maps relpath -> record
+        for root in self.roots:
+            self.scanners[root].store_cache(records, self.prefix(root))
+            self.scanners[root].save_manifest()
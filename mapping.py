@@ -0,0 +1,124 @@
+import os
+import re
+import pickle
+import numpy as np
+import pandas as pd
+import diagnostics
+
+CACHE_VERSION = 2
+MAPPING_COLUMNS = ['guid', 'dbfid', 'cardname', 'texname', 'texhash']
+CATEGORICAL_COLUMNS = ['guid', 'cardname', 'texname']
+#   Hexes are held as 32 bit integers, <NA> where there is none
+HEX_DTYPE = 'UInt32'
+HEX_PATTERN = re.compile('[0-9A-Fa-f]{1,8}\\Z')
+#   Texture file names only count as hexes with all 8 digits
+FILE_HEX_PATTERN = re.compile('[0-9A-Fa-f]{8}\\Z')
+
+#   Helpers around mapping_df (final.csv), which contains:
+#       guid, dbfid, cardname, texname, texhash
+#   texhash is empty for textures which have not been hashed yet. In memory
+#   texhash is a HEX_DTYPE column and the name columns are categoricals,
+#   final.csv holds texhash as 8 uppercase hex digits.
+
+def parse_hex(values, pattern=HEX_PATTERN):
+    # Hex strings -> HEX_DTYPE array, anything which does not match pattern
+    # (1 to 8 hex digits by default) becomes <NA>
+    match = pattern.match
+    parsed = np.array([int(v, 16) if isinstance(v, str) and match(v) else -1 for v in values], dtype='int64')
+    return pd.arrays.IntegerArray(parsed.astype('uint32'), parsed < 0)
+
+def format_hex(values):
+    # HEX_DTYPE values -> list of 8 digit hex strings, None for <NA>
+    values = pd.array(values, dtype=HEX_DTYPE)
+    digits = values.to_numpy(dtype='uint32', na_value=0).astype('>u4').tobytes().hex().upper()
+    return [None if m else digits[i:i + 8] for i, m in zip(range(0, len(digits), 8), values.isna().tolist())]
+
+def csv_frame(mapping_df):
+    # mapping_df as it is written to final.csv
+    if 'texhash' in mapping_df and mapping_df['texhash'].dtype == HEX_DTYPE:
+        mapping_df = mapping_df.assign(texhash=format_hex(mapping_df['texhash']))
+    return mapping_df
+
+def build_texhash_index(mapping_df):
+    # texhash -> cardname, keeping the first row for every texhash so lookups
+    # return the same card as a linear scan of mapping_df would
+    if 'texhash' not in mapping_df or 'cardname' not in mapping_df:
+        return pd.Series(dtype=object)
+
+    hashed = mapping_df[['texhash', 'cardname']].dropna(subset=['texhash'])
+    hashed = hashed.drop_duplicates(subset='texhash', keep='first')
+    return pd.Series(hashed['cardname'].values, index=hashed['texhash'].to_numpy(dtype='uint32'))
+
+@diagnostics.span('resolve_ids')
+def resolve_ids(texhash_index, tex_hex):
+    # Resolves a whole scan of HEX_DTYPE hexes in one hash join. Unknown
+    # hexes resolve to None.
+    diagnostics.count('id_lookups', len(tex_hex))
+    tex_id = pd.Series(pd.array(tex_hex, dtype=HEX_DTYPE)).map(texhash_index)
+    return tex_id.astype(object).where(tex_id.notna(), None).tolist()
+
+def mapping_key(mapping_df_path):
+    # Changes whenever final.csv is rewritten or csv/VERSION is bumped
+    try:
+        st = os.stat(mapping_df_path)
+    except OSError:
+        return None
+
+    version = ''
+    try:
+        with open(os.path.join(os.path.dirname(mapping_df_path), 'VERSION'), encoding='utf-8') as f:
+            version = f.read().strip()
+    except OSError:
+        pass
+    return '%d:%d:%s' % (st.st_mtime_ns, st.st_size, version)
+
+def load_mapping(mapping_df_path, cache_path):
+    # Loads final.csv through a pickled copy with categorical columns, which
+    # is several times faster to read than tokenizing the csv. Raises
+    # ValueError if final.csv is missing or does not have the right format.
+    key = mapping_key(mapping_df_path)
+    if key is None:
+        raise ValueError('final.csv cannot be found')
+
+    try:
+        with open(cache_path, 'rb') as f:
+            cache = pickle.load(f)
+        if cache['version'] == CACHE_VERSION and cache['key'] == key:
+            return cache['mapping_df']
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, KeyError, TypeError):
+        pass
+
+    mapping_df = pd.read_csv(mapping_df_path, dtype={'texhash': str})
+    if 'texhash' not in mapping_df or 'cardname' not in mapping_df:
+        raise ValueError('final.csv does not have the right format')
+
+    mapping_df = compact_mapping(mapping_df)
+    write_cache(mapping_df, key, cache_path)
+    return mapping_df
+
+def save_mapping(mapping_df, mapping_df_path, cache_path):
+    # Rewrites final.csv and rebuilds the cache so the next start does not
+    # have to parse the csv again
+    csv_frame(mapping_df).to_csv(mapping_df_path, index=False)
+    mapping_df = compact_mapping(mapping_df)
+    write_cache(mapping_df, mapping_key(mapping_df_path), cache_path)
+    return mapping_df
+
+def compact_mapping(mapping_df):
+    mapping_df = mapping_df.copy()
+    for column in CATEGORICAL_COLUMNS:
+        if column in mapping_df and mapping_df[column].dtype != 'category':
+            mapping_df[column] = mapping_df[column].astype('category')
+    if 'texhash' in mapping_df and mapping_df['texhash'].dtype != HEX_DTYPE:
+        mapping_df['texhash'] = parse_hex(mapping_df['texhash'].astype(object).where(mapping_df['texhash'].notna(), None))
+    return mapping_df
+
+def write_cache(mapping_df, key, cache_path):
+    cache = {'version': CACHE_VERSION, 'key': key, 'mapping_df': mapping_df}
+    tmp_path = cache_path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
@@ -0,0 +1,281 @@
+import os
+import hashlib
+import heapq
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from PIL import Image
+import dds
+import diagnostics
+
+PREVIEW_SIZE = (500, 500)
+DEFAULT_MEMORY_MB = 128
+DEFAULT_DISK_MB = 2048
+
+@diagnostics.span('preview_decode')
+def render_preview(path, flip):
+    # Decodes only the smallest mip level covering the preview, formats the
+    # dds reader does not handle go through PIL
+    im = dds.open_level(path, PREVIEW_SIZE)
+    if im is None:
+        im = Image.open(path)
+    im = im.resize(PREVIEW_SIZE, Image.LANCZOS)
+    if flip:
+        im = im.transpose(Image.FLIP_TOP_BOTTOM)
+    return im
+
+def preview_key(path, size, mtime, flip):
+    key = '%s|%d|%d|%d' % (path, size, mtime, flip)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def image_bytes(im):
+    return im.width * im.height * len(im.getbands())
+
+def warm_preview(path, cache_file, flip):
+    # Runs in a worker process of PreviewCache.warm
+    try:
+        im = render_preview(path, flip)
+        tmp_file = cache_file + '.%d.tmp' % os.getpid()
+        im.save(tmp_file, 'PNG', compress_level=1)
+        os.replace(tmp_file, cache_file)
+        return os.path.getsize(cache_file)
+    except Exception:
+        # Any decoder error would otherwise surface from future.result()
+        # and abort the whole warm
+        return None
+
+class PreviewCache:
+
+    #   cache_dir is the directory holding the on-disk tier, one .png per preview
+    #   memory_budget and disk_budget are the size limits of each tier in bytes
+    #   memory maps key -> PIL image, least recently used first
+    #   disk maps key -> size of the .png, least recently used first
+    #   Keys are built from the full path, size and mtime of the texture and
+    #   the flip option, so a changed file or option never hits a stale entry.
+
+    def __init__(self, cache_dir, memory_budget=DEFAULT_MEMORY_MB * 1024 * 1024, disk_budget=DEFAULT_DISK_MB * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.memory = OrderedDict()
+        self.memory_used = 0
+        self.disk = OrderedDict()
+        self.disk_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+        self.load_disk_index()
+
+    def load_disk_index(self):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            entries = []
+            with os.scandir(self.cache_dir) as it:
+                for de in it:
+                    if de.name.endswith('.png'):
+                        st = de.stat()
+                        entries.append((st.st_mtime_ns, de.name[:-4], st.st_size))
+        except OSError:
+            return
+
+        entries.sort()
+        for mtime, key, size in entries:
+            self.disk[key] = size
+            self.disk_used += size
+        self.evict_disk()
+
+    def cache_file(self, key):
+        return os.path.join(self.cache_dir, key + '.png')
+
+    def key_of(self, path, flip):
+        st = os.stat(path)
+        return preview_key(path, st.st_size, st.st_mtime_ns, flip)
+
+    def get(self, path, flip):
+        # Returns the 500x500 preview of path, rendering it on a miss
+        key = self.key_of(path, flip)
+        im = self.lookup(key)
+        if im is not None:
+            return im
+
+        im = render_preview(path, flip)
+        self.store(key, im)
+        return im
+
+    def lookup(self, key):
+        with self.lock:
+            im = self.memory.get(key)
+            if im is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                diagnostics.count('preview_memory_hits')
+                return im
+
+            if key not in self.disk:
+                self.misses += 1
+                diagnostics.count('preview_misses')
+                return None
+            self.disk.move_to_end(key)
+
+        try:
+            cache_file = self.cache_file(key)
+            with Image.open(cache_file) as f:
+                im = f.copy()
+            # Keeps the on-disk LRU order across runs
+            os.utime(cache_file)
+        except OSError:
+            with self.lock:
+                self.misses += 1
+                self.forget_disk(key)
+            diagnostics.count('preview_misses')
+            return None
+
+        with self.lock:
+            self.hits += 1
+            diagnostics.count('preview_disk_hits')
+            self.remember(key, im)
+        return im
+
+    def store(self, key, im):
+        with self.lock:
+            self.remember(key, im)
+
+        cache_file = self.cache_file(key)
+        # Loader threads may render the same preview at the same time
+        tmp_file = cache_file + '.%d.tmp' % threading.get_ident()
+        try:
+            im.save(tmp_file, 'PNG', compress_level=1)
+            os.replace(tmp_file, cache_file)
+            size = os.path.getsize(cache_file)
+        except OSError:
+            return
+
+        with self.lock:
+            self.add_disk(key, size)
+            self.evict_disk()
+
+    def remember(self, key, im):
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return
+
+        self.memory[key] = im
+        self.memory_used += image_bytes(im)
+        while self.memory_used > self.memory_budget and len(self.memory) > 1:
+            _, old = self.memory.popitem(last=False)
+            self.memory_used -= image_bytes(old)
+
+    def add_disk(self, key, size):
+        self.forget_disk(key)
+        self.disk[key] = size
+        self.disk_used += size
+
+    def forget_disk(self, key):
+        size = self.disk.pop(key, None)
+        if size is not None:
+            self.disk_used -= size
+
+    def evict_disk(self):
+        while self.disk_used > self.disk_budget and self.disk:
+            key, size = self.disk.popitem(last=False)
+            self.disk_used -= size
+            try:
+                os.remove(self.cache_file(key))
+            except OSError:
+                pass
+
+    def warm(self, paths, flip, workers=None, progress=None):
+        # Pre-renders previews for paths into the on-disk tier on a process
+        # pool. Stops once the disk budget is full, since anything rendered
+        # after that would only evict earlier previews.
+        # progress is called as progress(done, total) from the calling thread.
+        jobs = []
+        for path in paths:
+            try:
+                key = self.key_of(path, flip)
+            except OSError:
+                continue
+            if key not in self.disk:
+                jobs.append((key, path))
+
+        done = 0
+        # Forking the threaded Tk process could copy a lock, like the one of
+        # diagnostics, while another thread holds it
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = {executor.submit(warm_preview, path, self.cache_file(key), flip): key for key, path in jobs}
+            for future in as_completed(futures):
+                done += 1
+                size = future.result()
+                if size is not None:
+                    with self.lock:
+                        self.add_disk(futures[future], size)
+                if progress:
+                    progress(done, len(jobs))
+                if self.disk_used >= self.disk_budget:
+                    executor.shutdown(cancel_futures=True)
+                    break
+
+        with self.lock:
+            self.evict_disk()
+        return done
+
+class PreviewLoader:
+
+    #   cache is the PreviewCache previews are rendered through
+    #   generation is bumped by every request; queued work of older
+    #   generations is cancelled and their results are dropped
+    #   jobs is a heap of (priority, order, generation, path, flip), priority 0
+    #   is the requested preview and 1 are prefetched neighbours
+    #   result is (generation, image or exception) of the last finished request
+
+    def __init__(self, cache, workers=2):
+        self.cache = cache
+        self.cond = threading.Condition()
+        self.generation = 0
+        self.jobs = []
+        self.result = None
+        for _ in range(workers):
+            threading.Thread(target=self.run, daemon=True).start()
+
+    def request(self, path, flip, prefetch=()):
+        # prefetch is a list of paths, nearest neighbour first, which are
+        # rendered into the cache once path is done
+        with self.cond:
+            self.generation += 1
+            self.jobs = [(0, 0, self.generation, path, flip)]
+            for order, p in enumerate(prefetch, 1):
+                self.jobs.append((1, order, self.generation, p, flip))
+            heapq.heapify(self.jobs)
+            self.cond.notify_all()
+            return self.generation
+
+    def poll(self):
+        # Returns (True, image or exception) once the latest request is done,
+        # (False, None) while it is still being rendered
+        with self.cond:
+            if self.result is None or self.result[0] != self.generation:
+                return False, None
+            _, value = self.result
+            self.result = None
+            return True, value
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.jobs:
+                    self.cond.wait()
+                priority, order, generation, path, flip = heapq.heappop(self.jobs)
+
+            try:
+                value = self.cache.get(path, flip)
+            except Exception as e:
+                # Anything a bad file raises, like PIL's DecompressionBombError
+                # or a MemoryError, is the result of this request, it must
+                # not end the worker
+                value = e
+
+            if priority == 0:
+                with self.cond:
+                    if generation == self.generation:
+                        self.result = (generation, value)
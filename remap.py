@@ -0,0 +1,220 @@
+import os
+import json
+import pandas as pd
+import diagnostics
+import mapping
+import scanner
+
+#   Bulk remap of the inject tree to a new final.csv. A plan is computed
+#   first, holding only the files whose hex actually changes. It is then
+#   executed as a list of renames, in batches, behind a journal so that an
+#   interrupted remap can be finished or undone on the next start.
+
+JOURNAL_VERSION = 1
+BATCH_SIZE = 1000
+TMP_SUFFIX = '.remap.tmp'
+MAPPING_KEYS = ['guid', 'cardname', 'texname']
+
+def read_mapping(path):
+    # Reads a new final.csv. Raises ValueError if it does not have the right
+    # format.
+    try:
+        mapping_df = pd.read_csv(path, dtype={'texhash': str})
+    except (OSError, pd.errors.EmptyDataError, pd.errors.ParserError) as e:
+        raise ValueError(str(e))
+
+    missing = [c for c in MAPPING_KEYS + ['texhash'] if c not in mapping_df]
+    if missing:
+        raise ValueError('missing columns: ' + ', '.join(missing))
+    return mapping_df
+
+def hex_map(old_mapping_df, new_mapping_df):
+    # Returns (old texhash -> new texhash, set of ambiguous old texhashes).
+    # Rows are matched on guid, cardname and texname; an old texhash which
+    # maps to more than one new texhash keeps the first.
+    # Hexes are compared as integers, the map goes from and to HEX_DTYPE
+    # values and ambiguous holds hex strings.
+    merged = hex_frame(old_mapping_df).merge(hex_frame(new_mapping_df), on=MAPPING_KEYS, suffixes=('_old', '_new'))
+    merged = merged[merged['texhash_old'] != merged['texhash_new']]
+
+    targets = merged.groupby('texhash_old', sort=False)['texhash_new'].nunique()
+    ambiguous = set(mapping.format_hex(targets.index[targets > 1]))
+
+    merged = merged.drop_duplicates(subset='texhash_old', keep='first')
+    return pd.Series(merged['texhash_new'].to_numpy(dtype='uint32'), index=merged['texhash_old'].to_numpy(dtype='uint32')), ambiguous
+
+def hex_frame(mapping_df):
+    # MAPPING_KEYS as objects and texhash as HEX_DTYPE, rows without a hex dropped
+    df = mapping_df[MAPPING_KEYS].astype(object)
+    texhash = mapping_df['texhash']
+    df['texhash'] = texhash.array if texhash.dtype == mapping.HEX_DTYPE else mapping.parse_hex(texhash.astype(object))
+    return df.dropna(subset=['texhash'])
+
+class RemapPlan:
+
+    #   moves is a dataframe of (src, dst) relpaths, only files whose hex
+    #   changes and whose destination is free once the plan has run
+    #   skipped is a dataframe of (src, dst, reason) for moves left out:
+    #       collision - dst exists and is not moved away by the plan
+    #       duplicate - several files would be renamed to the same dst
+    #   unchanged is the number of files which keep their name
+    #   ambiguous is the set of old hexes with more than one new hex
+
+    def __init__(self, tex_dir, tex_df, old_mapping_df, new_mapping_df):
+        self.tex_dir = tex_dir
+        new_hex, self.ambiguous = hex_map(old_mapping_df, new_mapping_df)
+
+        relpaths = scanner.tex_relpaths(tex_df)
+        target = tex_df['tex_hex'].map(new_hex)
+        changed = target.notna().to_numpy()
+        self.unchanged = int((~changed).sum())
+
+        src = [rp for rp, c in zip(relpaths, changed) if c]
+        dst = []
+        for rp, h in zip(src, target[changed]):
+            d, name = os.path.split(rp)
+            # Keep everything after the hex, like the extension
+            dst.append(os.path.join(d, '%08X' % int(h) + name[len(scanner.tex_hex_of(name)):]))
+
+        moves = pd.DataFrame({'src': src, 'dst': dst}, dtype=object)
+        self.moves, self.skipped = self.check(moves, set(relpaths))
+
+    def check(self, moves, existing):
+        # Drops moves which cannot be done. Dropping a move keeps its source in
+        # place, which may block another move, so repeat until nothing changes.
+        skipped = []
+        while len(moves):
+            duplicate = moves['dst'].duplicated(keep=False)
+            staying = existing - set(moves['src'])
+            exists = moves['dst'].isin(staying) | [
+                dst not in existing and os.path.lexists(os.path.join(self.tex_dir, dst)) for dst in moves['dst']
+            ]
+            bad = duplicate | exists
+            if not bad.any():
+                break
+            skipped.append(moves[bad].assign(reason=['duplicate' if d else 'collision' for d in duplicate[bad]]))
+            moves = moves[~bad]
+
+        skipped = pd.concat(skipped, ignore_index=True) if skipped else pd.DataFrame(columns=['src', 'dst', 'reason'])
+        return moves.reset_index(drop=True), skipped
+
+    def steps(self):
+        # The renames to run, in order. A file which is in the way of another
+        # move (a chain or a cycle of renames) is first moved to a temporary
+        # name, then every file goes to its destination.
+        targets = set(self.moves['dst'])
+        first = []
+        second = []
+        for src, dst in zip(self.moves['src'], self.moves['dst']):
+            if src in targets:
+                tmp = src + TMP_SUFFIX
+                first.append((src, tmp))
+                second.append((tmp, dst))
+            else:
+                second.append((src, dst))
+        return first + second
+
+    def report(self):
+        # Lines describing the plan, used as the dry run output
+        lines = [
+            '%d files to rename, %d unchanged, %d skipped' % (len(self.moves), self.unchanged, len(self.skipped))
+        ]
+        if self.ambiguous:
+            lines.append('%d old hexes map to several new hexes, the first is used' % len(self.ambiguous))
+        for src, dst in zip(self.moves['src'], self.moves['dst']):
+            lines.append('rename %s -> %s' % (src, dst))
+        for src, dst, reason in zip(self.skipped['src'], self.skipped['dst'], self.skipped['reason']):
+            lines.append('skip %s -> %s (%s)' % (src, dst, reason))
+        return lines
+
+@diagnostics.span('remap_execute')
+def execute(plan, journal_path, mapping_path=None, progress=None):
+    # Runs plan behind a journal. mapping_path is the new final.csv, stored in
+    # the journal so that a resumed remap can still install it; the caller
+    # removes the journal once it is installed.
+    # progress is called as progress(done, total) after every batch.
+    journal = {
+        'version': JOURNAL_VERSION,
+        'tex_dir': plan.tex_dir,
+        'mapping_path': mapping_path,
+        'steps': plan.steps(),
+        'done': 0
+    }
+    write_journal(journal, journal_path)
+    roll_forward(journal, journal_path, progress)
+
+def first_steps(steps):
+    # Number of steps moving a file out of the way to its temporary name,
+    # they all come before the moves to the destinations
+    n = 0
+    while n < len(steps) and steps[n][1] == steps[n][0] + TMP_SUFFIX:
+        n += 1
+    return n
+
+def batch_end(steps, done):
+    # End of the batch starting at done. A batch never holds steps of both
+    # phases, so a source which a later step of the same batch re-creates
+    # (B -> B.tmp, then A -> B) is never taken for a pending step.
+    split = first_steps(steps)
+    return min(split if done < split else len(steps), done + BATCH_SIZE)
+
+def roll_forward(journal, journal_path, progress=None):
+    # Runs the steps not done yet. The journal records how many steps are
+    # done after every batch, a step of the last batch is done if its source
+    # is gone and its destination is there.
+    tex_dir = journal['tex_dir']
+    steps = journal['steps']
+    while journal['done'] < len(steps):
+        end = batch_end(steps, journal['done'])
+        for src, dst in steps[journal['done']:end]:
+            src_path = os.path.join(tex_dir, src)
+            dst_path = os.path.join(tex_dir, dst)
+            if os.path.lexists(src_path):
+                if os.path.lexists(dst_path):
+                    raise OSError('cannot rename %s, %s already exists' % (src, dst))
+                os.rename(src_path, dst_path)
+            elif not os.path.lexists(dst_path):
+                raise OSError('%s is missing' % src)
+        journal['done'] = end
+        write_journal(journal, journal_path)
+        if progress:
+            progress(journal['done'], len(steps))
+
+def roll_back(journal, journal_path, progress=None):
+    # Undoes every step which was done, last first
+    tex_dir = journal['tex_dir']
+    steps = journal['steps']
+    end = batch_end(steps, journal['done']) if journal['done'] < len(steps) else len(steps)
+    for n, (src, dst) in enumerate(reversed(steps[:end]), 1):
+        src_path = os.path.join(tex_dir, src)
+        dst_path = os.path.join(tex_dir, dst)
+        if os.path.lexists(dst_path) and not os.path.lexists(src_path):
+            os.rename(dst_path, src_path)
+        if progress and n % BATCH_SIZE == 0:
+            progress(n, end)
+    remove_journal(journal_path)
+
+def load_journal(journal_path):
+    # Returns the journal of an interrupted remap, or None
+    try:
+        with open(journal_path, encoding='utf-8') as f:
+            journal = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if journal.get('version') != JOURNAL_VERSION:
+        return None
+    return journal
+
+def remove_journal(journal_path):
+    try:
+        os.remove(journal_path)
+    except FileNotFoundError:
+        pass
+
+def write_journal(journal, journal_path):
+    tmp_path = journal_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(journal, ensure_ascii=False, separators=(',', ':')))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, journal_path)
@@ -0,0 +1,617 @@
+import os
+import sys
+import json
+import bisect
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import pandas as pd
+import dds
+import diagnostics
+import mapping
+
+MANIFEST_VERSION = 5
+DEFAULT_WORKERS = 8
+#   New files of a directory whose headers are read by one thread
+HEADER_CHUNK = 512
+TEX_COLUMNS = ['tex_dir', 'tex_name', 'tex_hex', 'tex_id', 'tex_width', 'tex_height', 'tex_format', 'tex_mips', 'tex_size', 'tex_vram']
+TEX_DTYPES = {
+    'tex_dir': 'category',
+    'tex_name': 'category',
+    'tex_hex': mapping.HEX_DTYPE,
+    'tex_id': 'category',
+    'tex_width': 'uint32',
+    'tex_height': 'uint32',
+    'tex_format': 'category',
+    'tex_mips': 'uint8',
+    'tex_size': 'uint64',
+    'tex_vram': 'uint64'
+}
+
+#   Columns of a file table besides name
+NUMBER_FIELDS = ['size', 'mtime', 'width', 'height', 'mips', 'vram']
+STRING_FIELDS = ['id', 'format']
+
+#   id of a file which was not resolved yet, None is an unknown hex
+UNRESOLVED = False
+
+class TextureScanner:
+
+    #   tex_dir is the scanned texture directory
+    #   manifest_path is the path to the persisted manifest (manifest.json),
+    #   which holds the directory tree. The file table of every directory is
+    #   in its own shard in shard_dir, only the shards of directories which
+    #   changed are written again.
+    #   mapping_key identifies the final.csv the stored ids were resolved with
+    #   dirs maps the relpath of every directory ('' for tex_dir) to:
+    #       mtime - mtime of the directory when it was last listed
+    #       subdirs - names of its subdirectories
+    #       files - file table of its .dds files, a dict of columns:
+    #           name - list of file names
+    #           size, mtime - size and mtime of the file, int64 arrays
+    #           width, height, mips - read from the DDS header, int64 arrays
+    #           vram - estimated size of the mip chain once uploaded
+    #           id - list of tex_id resolved from mapping_df
+    #           format - list of formats read from the DDS header
+    #       cache - dict of field -> {file name: value} for values other
+    #           modules keep per file, like the hashes of dupes. The values
+    #           of a file are dropped when it changes.
+    #   The records are held as columns, a dict per file took most of the
+    #   memory of a scan. records() builds the dicts when they are needed.
+    #   tex_df is the dataframe built by the last scan, see MainWindow
+    #   dirty is set when the manifest has to be written, dirty_dirs holds
+    #   the directories whose shards have to be written or removed
+    #   Directories whose mtime did not change are not listed again, their
+    #   files are taken from the manifest. Directories are visited
+    #   concurrently on a pool of workers threads.
+
+    def __init__(self, tex_dir, manifest_path, workers=DEFAULT_WORKERS):
+        self.tex_dir = tex_dir
+        self.manifest_path = manifest_path
+        self.workers = max(1, workers)
+        self.mapping_key = None
+        self.dirs = {}
+        self.tex_df = None
+        self.dirty = False
+        self.dirty_dirs = set()
+        self.load_manifest()
+
+    @property
+    def shard_dir(self):
+        return os.path.splitext(self.manifest_path)[0] + '.dirs'
+
+    def load_manifest(self):
+        manifest = read_json(self.manifest_path)
+        if manifest is None or manifest.get('version') != MANIFEST_VERSION or manifest.get('tex_dir') != self.tex_dir:
+            return
+
+        self.mapping_key = manifest.get('mapping_key')
+        # json.loads makes a new str for every value, share the repeated ones
+        strings = {}
+        try:
+            for rel, entry in manifest.get('dirs', {}).items():
+                mtime = entry['mtime']
+                if entry['shard'] is None:
+                    files, cache = empty_files(), {}
+                else:
+                    shard = read_json(os.path.join(self.shard_dir, entry['shard']))
+                    if shard is None:
+                        # Lost, the directory is listed again
+                        shard = {'mtime': None, 'files': empty_files(), 'cache': {}}
+                    if shard['mtime'] != mtime:
+                        # Written after the manifest, its files are checked
+                        # against the directory once it is listed again
+                        mtime = None
+                    files, cache = shard['files'], shard['cache']
+
+                for field in NUMBER_FIELDS:
+                    files[field] = np.array(files[field], dtype=np.int64)
+                for field in STRING_FIELDS:
+                    files[field] = [strings.setdefault(v, v) if isinstance(v, str) else v for v in files[field]]
+                self.dirs[rel] = {'mtime': mtime, 'subdirs': entry['subdirs'], 'files': files, 'cache': cache}
+        except (KeyError, TypeError, ValueError):
+            self.mapping_key = None
+            self.dirs = {}
+
+    def save_manifest(self):
+        if not self.dirty:
+            return
+
+        # The manifest is only a cache, a scan which cannot save it still
+        # returns its tex_df and the next save tries again
+        try:
+            os.makedirs(self.shard_dir, exist_ok=True)
+            dirs = {}
+            for rel, entry in self.dirs.items():
+                files = entry['files']
+                shard = None
+                if files['name'] or entry['cache']:
+                    shard = shard_name(rel)
+                dirs[rel] = {'mtime': entry['mtime'], 'subdirs': entry['subdirs'], 'shard': shard}
+                if shard is None or rel not in self.dirty_dirs:
+                    continue
+
+                stored = {'name': files['name']}
+                for field in NUMBER_FIELDS:
+                    stored[field] = files[field].tolist()
+                for field in STRING_FIELDS:
+                    stored[field] = files[field]
+                write_json(os.path.join(self.shard_dir, shard), {'mtime': entry['mtime'], 'files': stored, 'cache': entry['cache']})
+
+            # Shards go first, a manifest never names a shard older than itself
+            write_json(self.manifest_path, {
+                'version': MANIFEST_VERSION,
+                'tex_dir': self.tex_dir,
+                'mapping_key': self.mapping_key,
+                'dirs': dirs
+            })
+
+            # Shards of directories which are gone or hold no files anymore,
+            # and after a full write anything left over from an older manifest
+            if self.dirty_dirs.issuperset(self.dirs):
+                stale = set(os.listdir(self.shard_dir)) - {entry['shard'] for entry in dirs.values()}
+            else:
+                stale = {shard_name(rel) for rel in self.dirty_dirs if dirs.get(rel, {}).get('shard') is None}
+            for name in stale:
+                try:
+                    os.remove(os.path.join(self.shard_dir, name))
+                except OSError:
+                    pass
+        except OSError as e:
+            sys.stderr.write('wstone: manifest %s not saved: %s\n' % (self.manifest_path, e))
+            return
+        self.dirty = False
+        self.dirty_dirs = set()
+
+    def scan(self, texhash_index, mapping_key, progress=None):
+        # progress is called as progress(dirs_seen, files_seen) from the
+        # calling thread while the walk is running
+        with diagnostics.span('scan_walk'):
+            new_dirs, listed = self.walk(self.dirs, progress)
+        with diagnostics.span('scan_update'):
+            return self.update(new_dirs, listed, texhash_index, mapping_key)
+
+    def refresh(self, rels, texhash_index, mapping_key):
+        # Lists only the directories in rels again, for changes reported by
+        # a watcher. New subdirectories are walked, directories which are
+        # gone are dropped together with everything below them.
+        new_dirs = dict(self.dirs)
+        listed = set()
+        pending = list(rels)
+        while pending:
+            rel = pending.pop()
+            try:
+                mtime = os.stat(os.path.join(self.tex_dir, rel)).st_mtime_ns
+            except OSError:
+                mtime = None
+            if mtime is None or not os.path.isdir(os.path.join(self.tex_dir, rel)):
+                prefix = os.path.join(rel, '')
+                for d in [d for d in new_dirs if d == rel or d.startswith(prefix)]:
+                    del new_dirs[d]
+                continue
+
+            old_entry = new_dirs.get(rel)
+            entry = self.list_dir(rel, mtime, old_entry)
+            new_dirs[rel] = entry
+            listed.add(rel)
+            old_subdirs = set(old_entry['subdirs']) if old_entry else set()
+            for d in old_subdirs.symmetric_difference(entry['subdirs']):
+                pending.append(os.path.join(rel, d))
+
+        with diagnostics.span('scan_update'):
+            return self.update(new_dirs, listed, texhash_index, mapping_key)
+
+    def update(self, new_dirs, listed, texhash_index, mapping_key):
+        # Applies a new directory table, listed are the directories which
+        # were listed again. Only the files of those are diffed.
+        old_dirs = self.dirs
+        removed = set()
+        added = {}
+        for rel in listed | (old_dirs.keys() - new_dirs.keys()):
+            old_keys = file_keys(old_dirs[rel]['files']) if rel in old_dirs else {}
+            new_keys = file_keys(new_dirs[rel]['files']) if rel in new_dirs else {}
+            removed.update(os.path.join(rel, name) for name, key in old_keys.items() if new_keys.get(name) != key)
+            rows = [i for i, (name, key) in enumerate(new_keys.items()) if old_keys.get(name) != key]
+            if rows:
+                added[rel] = rows
+
+        self.dirs = new_dirs
+        if removed or added or listed:
+            self.dirty = True
+            self.dirty_dirs |= listed | (old_dirs.keys() - new_dirs.keys())
+
+        if mapping_key != self.mapping_key or self.tex_df is None:
+            # ids may be stale, rebuild every row from the manifest
+            self.resolve(texhash_index, list(self.dirs), mapping_key != self.mapping_key)
+            self.mapping_key = mapping_key
+            self.tex_df = build_tex_df([(rel, entry['files']) for rel, entry in self.dirs.items()])
+        elif removed or added:
+            self.resolve(texhash_index, list(added), False)
+            parts = [(rel, take_rows(self.dirs[rel]['files'], rows)) for rel, rows in added.items()]
+            self.tex_df = insert_rows(remove_rows(self.tex_df, removed), build_tex_df(parts))
+
+        self.save_manifest()
+        return self.tex_df
+
+    def walk(self, old_dirs, progress=None):
+        # Returns the new directory table and the set of directories which
+        # had to be listed again
+        new_dirs = {}
+        listed = set()
+        files_seen = 0
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = {executor.submit(self.visit, '', old_dirs.get(''))}
+            while pending:
+                done, pending = wait(pending, timeout=0.05, return_when=FIRST_COMPLETED)
+                for future in done:
+                    rel, entry, was_listed = future.result()
+                    if entry is None:
+                        continue
+
+                    new_dirs[rel] = entry
+                    files_seen += len(entry['files']['name'])
+                    if was_listed:
+                        listed.add(rel)
+                    for d in entry['subdirs']:
+                        sub = os.path.join(rel, d)
+                        pending.add(executor.submit(self.visit, sub, old_dirs.get(sub)))
+
+                if progress:
+                    progress(len(new_dirs), files_seen)
+
+        return new_dirs, listed
+
+    def visit(self, rel, old_entry):
+        try:
+            mtime = os.stat(os.path.join(self.tex_dir, rel)).st_mtime_ns
+        except OSError:
+            return rel, None, False
+
+        if old_entry is not None and old_entry['mtime'] == mtime:
+            return rel, old_entry, False
+        return rel, self.list_dir(rel, mtime, old_entry), True
+
+    def list_dir(self, rel, mtime, old_entry):
+        old_files = old_entry['files'] if old_entry else empty_files()
+        old_rows = {name: i for i, name in enumerate(old_files['name'])}
+        subdirs = []
+        kept = []
+        names = []
+        stats = []
+
+        try:
+            it = os.scandir(os.path.join(self.tex_dir, rel))
+        except OSError:
+            return {'mtime': mtime, 'subdirs': [], 'files': empty_files(), 'cache': {}}
+
+        with it:
+            for de in it:
+                # glob skips hidden entries, so do the same
+                if de.name.startswith('.'):
+                    continue
+                try:
+                    if de.is_dir():
+                        subdirs.append(de.name)
+                    elif de.name.lower().endswith('.dds'):
+                        st = de.stat()
+                        i = old_rows.get(de.name)
+                        if i is not None and old_files['size'][i] == st.st_size and old_files['mtime'][i] == st.st_mtime_ns:
+                            kept.append(i)
+                        else:
+                            names.append(de.name)
+                            stats.append(st)
+                except OSError:
+                    continue
+        records = self.read_headers(rel, names, stats)
+
+        subdirs.sort()
+        files = join_tables([take_rows(old_files, kept), file_table(names, records)])
+        # Cached values of the files which did not change
+        kept_names = {old_files['name'][i] for i in kept}
+        cache = {}
+        for field, values in (old_entry['cache'] if old_entry else {}).items():
+            values = {name: value for name, value in values.items() if name in kept_names}
+            if values:
+                cache[field] = values
+        diagnostics.count('dirs_listed')
+        diagnostics.count('files_listed', len(files['name']))
+        return {'mtime': mtime, 'subdirs': subdirs, 'files': files, 'cache': cache}
+
+    def read_headers(self, rel, names, stats):
+        # Records of the new files of directory rel. The walk only runs
+        # directories in parallel, so the headers of a large directory, like
+        # a flat inject/textures, are read in chunks on a pool of their own.
+        base = os.path.join(self.tex_dir, rel)
+
+        def read(rows):
+            records = []
+            for i in rows:
+                record = {'size': stats[i].st_size, 'mtime': stats[i].st_mtime_ns}
+                record.update(read_header(os.path.join(base, names[i]), stats[i].st_size))
+                records.append(record)
+            return records
+
+        if self.workers == 1 or len(names) <= HEADER_CHUNK:
+            return read(range(len(names)))
+        chunks = [range(i, min(i + HEADER_CHUNK, len(names))) for i in range(0, len(names), HEADER_CHUNK)]
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(chunks))) as executor:
+            return [record for records in executor.map(read, chunks) for record in records]
+
+    def records(self):
+        # (relpath, record) of every file sorted by relpath. A record is a
+        # new dict of the fields of the file table and its cached values,
+        # store_cache keeps values added to it.
+        records = []
+        for rel, entry in self.dirs.items():
+            files = entry['files']
+            columns = [files[field].tolist() for field in NUMBER_FIELDS] + [files[field] for field in STRING_FIELDS]
+            fields = NUMBER_FIELDS + STRING_FIELDS
+            for name, values in zip(files['name'], zip(*columns)):
+                record = dict(zip(fields, values))
+                for field, cached in entry['cache'].items():
+                    if name in cached:
+                        record[field] = cached[name]
+                records.append((os.path.join(rel, name), record))
+        records.sort(key=lambda r: r[0])
+        return records
+
+    def store_cache(self, records, prefix=''):
+        # Keeps the values added to the dicts of records(), records maps
+        # relpath (below prefix) -> record
+        fields = set(NUMBER_FIELDS + STRING_FIELDS)
+        for rel, entry in self.dirs.items():
+            for name in entry['files']['name']:
+                relpath = os.path.join(prefix, rel, name) if prefix else os.path.join(rel, name)
+                record = records.get(relpath)
+                if record is None:
+                    continue
+                for field, value in record.items():
+                    if field not in fields and entry['cache'].get(field, {}).get(name) != value:
+                        entry['cache'].setdefault(field, {})[name] = value
+                        self.dirty = True
+                        self.dirty_dirs.add(rel)
+
+    def resolve(self, texhash_index, rels, force):
+        # Resolves the ids of the directories in rels which are UNRESOLVED,
+        # or all of them if force
+        pending = []
+        for rel in rels:
+            files = self.dirs[rel]['files']
+            rows = [i for i, tex_id in enumerate(files['id']) if force or tex_id is UNRESOLVED]
+            if rows:
+                pending.extend((files, i) for i in rows)
+                self.dirty_dirs.add(rel)
+        if not pending:
+            return
+
+        tex_hex = mapping.parse_hex([tex_hex_of(files['name'][i]) for files, i in pending], mapping.FILE_HEX_PATTERN)
+        for (files, i), tex_id in zip(pending, mapping.resolve_ids(texhash_index, tex_hex)):
+            files['id'][i] = tex_id
+        self.dirty = True
+
+def read_json(path):
+    # None if path is missing or not valid JSON
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_json(path, obj):
+    # The temporary name is per thread, so two writers never replace each
+    # other's file
+    tmp_path = '%s.%d.tmp' % (path, threading.get_ident())
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        # dumps uses the C encoder, json.dump does not
+        f.write(json.dumps(obj, ensure_ascii=False, separators=(',', ':')))
+    os.replace(tmp_path, path)
+
+def shard_name(rel):
+    return hashlib.sha1(rel.encode('utf-8', 'surrogateescape')).hexdigest()[:16] + '.json'
+
+#   A file table holds the records of a directory as columns, see
+#   TextureScanner. These build and combine them.
+
+def empty_files():
+    return file_table([], [])
+
+def file_table(names, records):
+    # records are dicts with the fields of a file table, id may be missing
+    files = {'name': list(names)}
+    for field in NUMBER_FIELDS:
+        files[field] = np.array([r[field] for r in records], dtype=np.int64)
+    for field in STRING_FIELDS:
+        files[field] = [r.get(field, UNRESOLVED) for r in records]
+    return files
+
+def take_rows(files, rows):
+    taken = {'name': [files['name'][i] for i in rows]}
+    for field in NUMBER_FIELDS:
+        taken[field] = files[field][np.asarray(rows, dtype=np.intp)]
+    for field in STRING_FIELDS:
+        taken[field] = [files[field][i] for i in rows]
+    return taken
+
+def join_tables(tables):
+    files = {'name': [name for t in tables for name in t['name']]}
+    for field in NUMBER_FIELDS:
+        files[field] = np.concatenate([t[field] for t in tables])
+    for field in STRING_FIELDS:
+        files[field] = [value for t in tables for value in t[field]]
+    return files
+
+def file_keys(files):
+    # name -> (size, mtime), a file changed if its key did
+    return dict(zip(files['name'], zip(files['size'].tolist(), files['mtime'].tolist())))
+
+def build_tex_df(parts):
+    # tex_df of the file tables of parts, a list of (directory relpath,
+    # file table), sorted by relpath
+    counts = [len(files['name']) for rel, files in parts]
+    if not sum(counts):
+        return empty_tex_df()
+    sep = os.sep
+    names = [name for rel, files in parts for name in files['name']]
+    dir_codes = np.repeat(np.arange(len(parts)), counts)
+    rels = [rel for rel, files in parts]
+    relpaths = [rels[c] + sep + name if rels[c] else name for c, name in zip(dir_codes.tolist(), names)]
+    order = np.array(sorted(range(len(relpaths)), key=relpaths.__getitem__), dtype=np.intp)
+
+    names = [names[i] for i in order]
+    tex_hex = mapping.parse_hex([name.split('.')[0] for name in names], mapping.FILE_HEX_PATTERN)
+    # Names which are just the hex and .dds are not stored
+    tex_name = [
+        None if h is not None and name == h + '.dds' else name
+        for name, h in zip(names, mapping.format_hex(tex_hex))
+    ]
+    columns = {field: np.concatenate([files[field] for rel, files in parts])[order] for field in NUMBER_FIELDS}
+    strings = {field: [v for rel, files in parts for v in files[field]] for field in STRING_FIELDS}
+    # Directories as categories straight from their codes, only the ones
+    # holding files and in order, as astype would make them
+    tex_dir = pd.Categorical.from_codes(dir_codes[order], categories=rels).remove_unused_categories()
+    tex_dict = {
+        'tex_dir': tex_dir.set_categories(sorted(tex_dir.categories)),
+        'tex_name': tex_name,
+        'tex_hex': tex_hex,
+        'tex_id': [strings['id'][i] for i in order],
+        'tex_width': columns['width'],
+        'tex_height': columns['height'],
+        'tex_format': [strings['format'][i] for i in order],
+        'tex_mips': columns['mips'],
+        'tex_size': columns['size'],
+        'tex_vram': columns['vram']
+    }
+    return pd.DataFrame(tex_dict, columns=TEX_COLUMNS).astype(TEX_DTYPES)
+
+#   Categorical columns of tex_df, their categories are sorted and only
+#   hold values which are used, as astype makes them
+CATEGORY_COLUMNS = [column for column, dtype in TEX_DTYPES.items() if dtype == 'category']
+
+class RelpathKeys:
+
+    #   The relpaths of a tex_df, built when they are looked at, so bisect
+    #   can search a tex_df sorted by relpath without building them all
+
+    def __init__(self, tex_df):
+        self.dirs = tex_df['tex_dir'].cat.categories.to_numpy(dtype=object)
+        self.dir_codes = tex_df['tex_dir'].cat.codes.to_numpy()
+        self.names = tex_df['tex_name'].cat.categories.to_numpy(dtype=object)
+        self.name_codes = tex_df['tex_name'].cat.codes.to_numpy()
+        self.hexes = tex_df['tex_hex'].to_numpy(dtype='int64', na_value=0)
+
+    def __len__(self):
+        return len(self.dir_codes)
+
+    def __getitem__(self, i):
+        d = self.dirs[self.dir_codes[i]]
+        c = self.name_codes[i]
+        name = self.names[c] if c >= 0 else '%08X.dds' % self.hexes[i]
+        return d + os.sep + name if d else name
+
+def remove_rows(tex_df, relpaths):
+    # tex_df without the rows of relpaths. Only the rows in the directories
+    # of relpaths have their relpaths built.
+    if not relpaths:
+        return tex_df
+    dir_codes = tex_df['tex_dir'].cat.categories.get_indexer(list({os.path.dirname(rp) for rp in relpaths}))
+    rows = np.flatnonzero(np.isin(tex_df['tex_dir'].cat.codes.to_numpy(), dir_codes[dir_codes >= 0]))
+    keep = np.ones(len(tex_df), dtype=bool)
+    keep[[i for i, rp in zip(rows, tex_relpaths(tex_df.iloc[rows])) if rp in relpaths]] = False
+    tex_df = tex_df[keep].reset_index(drop=True)
+    for column in CATEGORY_COLUMNS:
+        tex_df[column] = tex_df[column].cat.remove_unused_categories()
+    return tex_df
+
+def insert_rows(tex_df, new_df):
+    # Merges new_df into tex_df, both sorted by relpath with no relpath in
+    # both. New rows are placed by bisecting the relpaths of tex_df.
+    if not len(new_df):
+        return tex_df
+    tex_df = tex_df.copy()
+    new_df = new_df.copy()
+    for column in CATEGORY_COLUMNS:
+        categories = tex_df[column].cat.categories.union(new_df[column].cat.categories)
+        if len(categories) != len(tex_df[column].cat.categories):
+            tex_df[column] = tex_df[column].cat.set_categories(categories)
+        new_df[column] = new_df[column].cat.set_categories(tex_df[column].cat.categories)
+
+    keys = RelpathKeys(tex_df)
+    positions = []
+    lo = 0
+    for relpath in tex_relpaths(new_df):
+        lo = bisect.bisect_left(keys, relpath, lo)
+        positions.append(lo)
+    order = np.insert(np.arange(len(tex_df)), positions, np.arange(len(tex_df), len(tex_df) + len(new_df)))
+    return pd.concat([tex_df, new_df], ignore_index=True).iloc[order].reset_index(drop=True)
+
+def empty_tex_df():
+    return pd.DataFrame(columns=TEX_COLUMNS).astype(TEX_DTYPES)
+
+def tex_hex_of(relpath):
+    return os.path.basename(relpath).split('.')[0]
+
+#   tex_df does not hold relpaths. A row is in directory tex_dir, its file
+#   name is tex_name, or the 8 digit tex_hex and .dds where tex_name is
+#   empty. These rebuild the strings, positions are iloc positions.
+
+def category_values(column):
+    # Code -1 (missing) takes the None appended at the end
+    categories = np.append(column.cat.categories.to_numpy(dtype=object), None)
+    return categories.take(column.cat.codes.to_numpy()).tolist()
+
+def tex_names(tex_df):
+    return [
+        name if name is not None else h + '.dds'
+        for name, h in zip(category_values(tex_df['tex_name']), mapping.format_hex(tex_df['tex_hex']))
+    ]
+
+def tex_relpaths(tex_df):
+    sep = os.sep
+    return [d + sep + name if d else name for d, name in zip(category_values(tex_df['tex_dir']), tex_names(tex_df))]
+
+def tex_hexes(tex_df):
+    # The hex part of every file name, as shown in the list
+    return [name.split('.')[0] for name in tex_names(tex_df)]
+
+def tex_name_at(tex_df, i):
+    name = tex_df['tex_name'].iloc[i]
+    if isinstance(name, str):
+        return name
+    return '%08X.dds' % tex_df['tex_hex'].iloc[i]
+
+def tex_relpath_at(tex_df, i):
+    return os.path.join(tex_df['tex_dir'].iloc[i], tex_name_at(tex_df, i))
+
+def tex_hex_at(tex_df, i):
+    return tex_hex_of(tex_name_at(tex_df, i))
+
+def read_header(path, size):
+    # Header fields of a manifest record. Only the first 148 bytes are read.
+    diagnostics.count('headers_read')
+    try:
+        info = dds.read_info(path)
+    except (OSError, ValueError):
+        return {'width': 0, 'height': 0, 'format': 'invalid', 'mips': 0, 'vram': 0}
+
+    vram = dds.surface_size(info)
+    if vram is None:
+        vram = max(0, size - info.data_offset)
+    return {
+        'width': info.width,
+        'height': info.height,
+        'format': info.format,
+        'mips': min(info.mips, 255),
+        'vram': vram
+    }
+
+def directory_stats(tex_df):
+    # Aggregate numbers shown by MainWindow.show_stats
+    return {
+        'files': len(tex_df),
+        'size': int(tex_df['tex_size'].sum()),
+        'vram': int(tex_df['tex_vram'].sum()),
+        '4k': int(((tex_df['tex_width'] >= 4096) | (tex_df['tex_height'] >= 4096)).sum()),
+        'formats': tex_df['tex_format'].value_counts(sort=True).astype(int).to_dict()
+    }
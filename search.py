@@ -0,0 +1,148 @@
+import re
+import bisect
+import numpy as np
+import pandas as pd
+import diagnostics
+import scanner
+
+#   Highest code point, appended to a prefix to find the end of its range
+PREFIX_END = '\U0010ffff'
+
+#   Fuzzy search: a key matches if it holds at least FUZZY_MIN_COVER of the
+#   trigrams of the query, at most FUZZY_LIMIT rows are returned
+FUZZY_MIN_COVER = 0.5
+FUZZY_LIMIT = 200
+
+#   Characters which separate words, replaced one for one with spaces
+SEPARATOR_PATTERN = re.compile(r'[\W_]')
+
+def trigram_codes(text):
+    # Trigrams of the words of text, which is lowercase, has its separators
+    # replaced and is padded with a space on both sides. Every trigram is
+    # its three code points packed in an int64, trigrams with a space in the
+    # middle span two words and are left out.
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+    grams = (codes[:-2] << 42) | (codes[1:-1] << 21) | codes[2:]
+    return grams, np.flatnonzero(codes[1:-1] != 32)
+
+class SearchIndex:
+
+    #   Prefix and trigram index over tex_df, case insensitive. Each row of tex_df is
+    #   reachable through its tex_id, its tex_hex and the texname and guid of
+    #   every final.csv row with the same texhash.
+    #   keys is a sorted list of lowercase keys
+    #   rows holds the tex_df position of every key
+    #   last is (query, lo, hi) of the previous search, a query which extends
+    #   it only has to look between lo and hi
+    #   The trigram index of the fuzzy search is described in build_fuzzy
+
+    @diagnostics.span('search_index')
+    def __init__(self, tex_df, mapping_df):
+        positions = pd.RangeIndex(len(tex_df))
+        frames = [
+            pd.DataFrame({'key': tex_df['tex_id'].astype(object).values, 'row': positions}),
+            pd.DataFrame({'key': scanner.tex_hexes(tex_df), 'row': positions})
+        ]
+
+        if len(mapping_df):
+            hexes = pd.DataFrame({'texhash': tex_df['tex_hex'].values, 'row': positions}).dropna()
+            names = hexes.merge(mapping_df[['texhash', 'texname', 'guid']].dropna(subset=['texhash']), on='texhash')
+            frames.append(pd.DataFrame({'key': names['texname'].astype(object).values, 'row': names['row'].values}))
+            frames.append(pd.DataFrame({'key': names['guid'].astype(object).values, 'row': names['row'].values}))
+
+        keys = pd.concat(frames, ignore_index=True).dropna()
+        keys['key'] = keys['key'].astype(str).str.lower()
+        keys = keys.drop_duplicates()
+
+        # sorted() on a list of str is faster than argsort on an object array
+        key_list = keys['key'].tolist()
+        order = sorted(range(len(key_list)), key=key_list.__getitem__)
+        self.keys = [key_list[i] for i in order]
+        self.rows = keys['row'].to_numpy(dtype=np.int64)[order]
+        self.last = None
+        self.build_fuzzy()
+
+    @diagnostics.span('search_fuzzy_index')
+    def build_fuzzy(self):
+        # Trigram index over the distinct keys. Equal keys are adjacent in
+        # keys, so distinct key k owns rows[starts[k]:starts[k + 1]].
+        #   gram_codes is the sorted array of every trigram
+        #   postings[offsets[g]:offsets[g + 1]] are the distinct keys holding
+        #   trigram gram_codes[g]
+        #   gram_counts is the number of distinct trigrams of every key
+        keys = np.array(self.keys, dtype=object)
+        starts = np.flatnonzero(np.append(True, keys[1:] != keys[:-1])) if len(keys) else np.zeros(0, dtype=np.int64)
+        self.starts = np.append(starts, len(keys))
+        distinct = keys[starts].tolist()
+
+        # All keys in one string, one space apart, so a single pass finds
+        # every trigram and the position of its middle character tells the key
+        text = SEPARATOR_PATTERN.sub(' ', ' ' + ' '.join(distinct) + ' ')
+        grams, middles = trigram_codes(text)
+        key_starts = np.cumsum([0] + [len(key) + 1 for key in distinct])
+        key_ids = np.searchsorted(key_starts, middles, side='right') - 1
+
+        # (gram id, key id) pairs packed in one int64, sorting them orders
+        # the postings by trigram and drops repeated trigrams of a key
+        self.gram_codes, gram_ids = np.unique(grams[middles], return_inverse=True)
+        pairs = np.unique(gram_ids.astype(np.int64) * len(distinct) + key_ids)
+        self.postings = pairs % len(distinct)
+        self.offsets = np.searchsorted(pairs // len(distinct), np.arange(len(self.gram_codes) + 1))
+        self.gram_counts = np.maximum(np.bincount(self.postings, minlength=len(distinct)), 1)
+
+    def prefix(self, query):
+        # Returns the sorted tex_df positions with a key starting with query
+        query = query.lower()
+        lo, hi = 0, len(self.keys)
+        if self.last is not None and query.startswith(self.last[0]):
+            lo, hi = self.last[1], self.last[2]
+
+        lo = bisect.bisect_left(self.keys, query, lo, hi)
+        hi = bisect.bisect_left(self.keys, query + PREFIX_END, lo, hi)
+        self.last = (query, lo, hi)
+        return np.unique(self.rows[lo:hi])
+
+    def fuzzy(self, query, limit=FUZZY_LIMIT, mask=None):
+        # Returns up to limit tex_df positions ranked by how well their best
+        # key matches query. mask is an optional boolean array over tex_df
+        # rows, rows outside it are dropped before the limit is applied. A key scores the share of query trigrams it
+        # holds, plus a tenth of the share of its own trigrams the query
+        # holds, so among equally good matches shorter keys come first.
+        # Queries too short for a trigram fall back to prefix. The last word
+        # of query may still be being typed and gets no end padding.
+        grams, middles = trigram_codes(' ' + SEPARATOR_PATTERN.sub(' ', query.lower()))
+        query_grams = np.unique(grams[middles])
+        if not len(query_grams):
+            rows = self.prefix(query)
+            if mask is not None:
+                rows = rows[mask[rows]]
+            return rows[:limit]
+        known = np.searchsorted(self.gram_codes, query_grams[np.isin(query_grams, self.gram_codes)])
+        if not len(known):
+            return np.zeros(0, dtype=np.int64)
+
+        hits = np.concatenate([self.postings[self.offsets[g]:self.offsets[g + 1]] for g in known])
+        shared = np.bincount(hits, minlength=len(self.gram_counts))
+        candidates = np.flatnonzero(shared >= FUZZY_MIN_COVER * len(query_grams))
+        shared = shared[candidates]
+        score = shared / len(query_grams) + 0.1 * shared / self.gram_counts[candidates]
+
+        # Best keys first, each expanded to its rows, a row keeps the rank
+        # of its best key
+        ranked = candidates[np.argsort(-score, kind='stable')]
+        lengths = self.starts[ranked + 1] - self.starts[ranked]
+        ends = np.cumsum(lengths)
+        positions = np.arange(ends[-1] if len(ends) else 0) + np.repeat(self.starts[ranked] - (ends - lengths), lengths)
+        rows = self.rows[positions]
+        _, first = np.unique(rows, return_index=True)
+        rows = rows[np.sort(first)]
+        if mask is not None:
+            rows = rows[mask[rows]]
+        return rows[:limit]
+
+def regex(tex_df, query):
+    # The original search: tex_id matches first, then tex_hex matches.
+    # Raises re.error for an invalid pattern.
+    df1 = tex_df[tex_df['tex_id'].astype(object).str.match(query, na=False)]
+    df2 = tex_df[pd.Series(scanner.tex_hexes(tex_df), index=tex_df.index, dtype=object).str.match(query, na=False)]
+    return pd.concat([df1, df2], ignore_index=True, sort=False).drop_duplicates(keep='first')
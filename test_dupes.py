@@ -0,0 +1,38 @@
+import pandas as pd
+import bench
+import dupes
+import mapping
+import scanner
+
+#   Regression tests of find_duplicates, run with `python -m pytest`.
+
+def scan(tmp_path, files):
+    # Writes files, a dict of name -> texture data, as DDS files and scans them
+    for name, data in files.items():
+        (tmp_path / name).write_bytes(bench.dds_file(16, 16, 1, data))
+    texture_scanner = scanner.TextureScanner(str(tmp_path), str(tmp_path / 'manifest.json'), 2)
+    return texture_scanner.scan(mapping.build_texhash_index(pd.DataFrame(columns=mapping.MAPPING_COLUMNS)), 'test')
+
+def content_groups(tmp_path, tex_df):
+    groups = dupes.find_duplicates(str(tmp_path), tex_df, workers=2)
+    return [group['relpaths'] for group in groups if group['kind'] == 'content']
+
+def test_difference_between_samples(tmp_path):
+    # Files between SAMPLE_SIZE and 2 * SAMPLE_SIZE bytes which only differ
+    # after the first SAMPLE_SIZE bytes are not duplicates
+    data = bytes(100 * 1024)
+    changed = data[:92160] + b'\x01' + data[92161:]
+    tex_df = scan(tmp_path, {'00000001.dds': data, '00000002.dds': changed})
+    assert content_groups(tmp_path, tex_df) == []
+
+def test_identical_files(tmp_path):
+    data = bytes(range(256)) * 400
+    tex_df = scan(tmp_path, {'00000001.dds': data, '00000002.dds': data, '00000003.dds': data[::-1]})
+    assert content_groups(tmp_path, tex_df) == [['00000001.dds', '00000002.dds']]
+
+def test_large_files_differing_in_the_middle(tmp_path):
+    # Larger than 2 * SAMPLE_SIZE, equal samples but not equal content
+    data = bytes(3 * dupes.SAMPLE_SIZE)
+    changed = data[:dupes.SAMPLE_SIZE + 10] + b'\x01' + data[dupes.SAMPLE_SIZE + 11:]
+    tex_df = scan(tmp_path, {'00000001.dds': data, '00000002.dds': changed})
+    assert content_groups(tmp_path, tex_df) == []
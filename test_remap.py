@@ -0,0 +1,46 @@
+import remap
+
+#   Regression tests of resuming an interrupted remap, run with
+#   `python -m pytest`.
+
+def interrupted(tmp_path, steps, done_steps):
+    # Journal of a remap which crashed after running done_steps of steps,
+    # recording only the batches which were finished
+    done = 0
+    while done < len(steps) and remap.batch_end(steps, done) <= done_steps:
+        done = remap.batch_end(steps, done)
+    journal = {'version': remap.JOURNAL_VERSION, 'tex_dir': str(tmp_path), 'mapping_path': None, 'steps': steps, 'done': done}
+    remap.write_journal(journal, str(tmp_path / 'remap.journal'))
+    for src, dst in steps[:done_steps]:
+        (tmp_path / src).rename(tmp_path / dst)
+    return journal
+
+def contents(tmp_path, names):
+    return [(tmp_path / name).read_text() for name in names]
+
+def test_resume_chain(tmp_path):
+    # A -> B -> C, B is moved out of the way first
+    for name in ('A.dds', 'B.dds'):
+        (tmp_path / name).write_text(name)
+    steps = [('B.dds', 'B.dds' + remap.TMP_SUFFIX), ('A.dds', 'B.dds'), ('B.dds' + remap.TMP_SUFFIX, 'C.dds')]
+    for done_steps in range(len(steps) + 1):
+        journal = interrupted(tmp_path, steps, done_steps)
+        remap.roll_forward(journal, str(tmp_path / 'remap.journal'))
+        assert contents(tmp_path, ['B.dds', 'C.dds']) == ['A.dds', 'B.dds']
+        assert not (tmp_path / 'A.dds').exists()
+        remap.roll_back(remap.load_journal(str(tmp_path / 'remap.journal')), str(tmp_path / 'remap.journal'))
+        assert contents(tmp_path, ['A.dds', 'B.dds']) == ['A.dds', 'B.dds']
+
+def test_roll_back_cycle(tmp_path):
+    # A <-> B, interrupted at every step and undone
+    for name in ('A.dds', 'B.dds'):
+        (tmp_path / name).write_text(name)
+    steps = [
+        ('A.dds', 'A.dds' + remap.TMP_SUFFIX), ('B.dds', 'B.dds' + remap.TMP_SUFFIX),
+        ('A.dds' + remap.TMP_SUFFIX, 'B.dds'), ('B.dds' + remap.TMP_SUFFIX, 'A.dds')
+    ]
+    for done_steps in range(len(steps) + 1):
+        journal = interrupted(tmp_path, steps, done_steps)
+        remap.roll_back(journal, str(tmp_path / 'remap.journal'))
+        assert contents(tmp_path, ['A.dds', 'B.dds']) == ['A.dds', 'B.dds']
+        assert sorted(p.name for p in tmp_path.iterdir()) == ['A.dds', 'B.dds']
@@ -0,0 +1,98 @@
+import os
+import pandas as pd
+import bench
+import library
+import mapping
+import scanner
+
+#   Regression tests of incremental rescans, run with `python -m pytest`.
+
+INDEX = mapping.build_texhash_index(pd.DataFrame(columns=mapping.MAPPING_COLUMNS))
+
+def write(path, size=16):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(bench.dds_file(size, size, 1, bytes(size * size * 4)))
+
+def touch_dir(path, step):
+    # Directory mtimes may not change between two quick writes
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + step * 1000000000))
+
+def scan(tex_dir, manifest_path):
+    return scanner.TextureScanner(str(tex_dir), str(manifest_path), 2).scan(INDEX, 'test')
+
+def make_tree(tmp_path):
+    tex_dir = tmp_path / 'textures'
+    for name in ('00000001.dds', '00000003.dds', 'a/00000002.dds', 'a/00000004.dds', 'b/00000005.dds'):
+        write(tex_dir / name)
+    return tex_dir
+
+def test_rescan_matches_full_scan(tmp_path):
+    tex_dir = make_tree(tmp_path)
+    texture_scanner = scanner.TextureScanner(str(tex_dir), str(tmp_path / 'manifest.json'), 2)
+    texture_scanner.scan(INDEX, 'test')
+
+    (tex_dir / 'a' / '00000002.dds').unlink()
+    write(tex_dir / 'a' / '00000006.dds')
+    write(tex_dir / '00000001.dds', 32)
+    write(tex_dir / 'c' / '00000000.dds')
+    for d in ('', 'a'):
+        touch_dir(tex_dir / d, 1)
+    tex_df = texture_scanner.scan(INDEX, 'test')
+
+    full_df = scan(tex_dir, tmp_path / 'other.json')
+    assert scanner.tex_relpaths(tex_df) == scanner.tex_relpaths(full_df)
+    pd.testing.assert_frame_equal(tex_df, full_df)
+
+def test_unchanged_directories_are_not_listed(tmp_path, monkeypatch):
+    tex_dir = make_tree(tmp_path)
+    scan(tex_dir, tmp_path / 'manifest.json')
+
+    listed = []
+    list_dir = scanner.TextureScanner.list_dir
+    monkeypatch.setattr(scanner.TextureScanner, 'list_dir', lambda self, rel, *args: listed.append(rel) or list_dir(self, rel, *args))
+    write(tex_dir / 'b' / '00000007.dds')
+    touch_dir(tex_dir / 'b', 1)
+    tex_df = scan(tex_dir, tmp_path / 'manifest.json')
+
+    assert listed == ['b']
+    assert os.path.join('b', '00000007.dds') in scanner.tex_relpaths(tex_df)
+
+def test_only_changed_shards_are_written(tmp_path, monkeypatch):
+    tex_dir = make_tree(tmp_path)
+    texture_scanner = scanner.TextureScanner(str(tex_dir), str(tmp_path / 'manifest.json'), 2)
+    texture_scanner.scan(INDEX, 'test')
+    assert len(os.listdir(texture_scanner.shard_dir)) == 3
+
+    written = []
+    write_json = scanner.write_json
+    monkeypatch.setattr(scanner, 'write_json', lambda path, obj: written.append(path) or write_json(path, obj))
+    (tex_dir / 'b' / '00000005.dds').unlink()
+    touch_dir(tex_dir / 'b', 1)
+    texture_scanner.scan(INDEX, 'test')
+
+    # b holds no files anymore, only the manifest is written and its shard
+    # is removed
+    assert written == [str(tmp_path / 'manifest.json')]
+    assert len(os.listdir(texture_scanner.shard_dir)) == 2
+
+def test_unwritable_manifest(tmp_path):
+    # The scan still returns its tex_df when the manifest cannot be saved
+    tex_dir = make_tree(tmp_path)
+    (tmp_path / 'manifests').write_text('')
+    texture_library = library.Library(str(tmp_path / 'manifests'), 2)
+    texture_library.set_roots([str(tex_dir)])
+    tex_df = texture_library.scan(INDEX, 'test')
+    assert len(tex_df) == 5
+
+def test_headers_read_in_chunks(tmp_path, monkeypatch):
+    # A directory larger than HEADER_CHUNK gives the same table as one read
+    # by a single thread
+    tex_dir = tmp_path / 'textures'
+    for i in range(10):
+        write(tex_dir / ('%08X.dds' % i), 4 << (i % 3))
+    single = scanner.TextureScanner(str(tex_dir), str(tmp_path / 'single.json'), 1).scan(INDEX, 'test')
+    monkeypatch.setattr(scanner, 'HEADER_CHUNK', 3)
+    chunked = scan(tex_dir, tmp_path / 'chunked.json')
+    pd.testing.assert_frame_equal(chunked, single)
+    assert chunked['tex_width'].tolist() == [4 << (i % 3) for i in range(10)]
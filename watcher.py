@@ -0,0 +1,271 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import threading
+
+#   Watches tex_dir for files being created, deleted or renamed and reports
+#   the directories which have to be listed again. Events are coalesced: a
+#   batch is only handed out once no event came in for QUIET seconds, or
+#   MAX_DELAY seconds after its first event, so a burst like unzipping
+#   thousands of files ends up as a handful of refreshes.
+#   inotify is used on Linux, every other platform polls directory mtimes.
+
+QUIET = 0.5
+MAX_DELAY = 3.0
+POLL_INTERVAL = 2.0
+
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_MOVE_SELF = 0x800
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT_HEADER = struct.Struct('iIII')
+
+def create_watcher(tex_dir):
+    # inotify if it is available, polling otherwise
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(tex_dir)
+        except OSError:
+            pass
+    return PollingWatcher(tex_dir)
+
+class Watcher:
+
+    #   tex_dir is the watched texture directory
+    #   pending is the set of directory relpaths changed since the last batch
+    #   full is set when events were lost and everything has to be rescanned
+    #   first and last are the times of the first and last pending event
+    #   Subclasses supply poll(), which waits up to about a second for changes
+    #   and passes them to mark(). run calls it on the watcher thread until
+    #   stop, after setup() has done the initial walk of the tree and before
+    #   close() releases whatever setup acquired.
+
+    def __init__(self, tex_dir):
+        self.tex_dir = tex_dir
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.full = False
+        self.first = None
+        self.last = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def mark(self, rels, full=False):
+        now = time.monotonic()
+        with self.lock:
+            self.pending.update(rels)
+            self.full = self.full or full
+            if self.first is None:
+                self.first = now
+            self.last = now
+
+    def changes(self):
+        # Returns (full, set of directory relpaths) once a batch is ready,
+        # None otherwise. Called from the Tk thread.
+        now = time.monotonic()
+        with self.lock:
+            if self.first is None:
+                return None
+            if now - self.last < QUIET and now - self.first < MAX_DELAY:
+                return None
+            batch = (self.full, self.pending)
+            self.pending = set()
+            self.full = False
+            self.first = self.last = None
+        return batch
+
+    def run(self):
+        try:
+            self.setup()
+            while not self.stopped.is_set():
+                self.poll()
+        finally:
+            self.close()
+
+    def setup(self):
+        pass
+
+    def close(self):
+        pass
+
+class PollingWatcher(Watcher):
+
+    #   Stats every known directory each POLL_INTERVAL seconds. A file being
+    #   added, removed or renamed changes the mtime of its directory.
+    #   mtimes maps directory relpath -> mtime
+
+    def __init__(self, tex_dir):
+        Watcher.__init__(self, tex_dir)
+        self.mtimes = {}
+
+    def list_tree(self, rel):
+        # Records the mtime of rel and every directory below it
+        stack = [rel]
+        while stack:
+            rel = stack.pop()
+            path = os.path.join(self.tex_dir, rel)
+            try:
+                self.mtimes[rel] = os.stat(path).st_mtime_ns
+                with os.scandir(path) as it:
+                    for de in it:
+                        if not de.name.startswith('.') and de.is_dir():
+                            stack.append(os.path.join(rel, de.name))
+            except OSError:
+                self.mtimes.pop(rel, None)
+
+    def setup(self):
+        self.list_tree('')
+
+    def poll(self):
+        if self.stopped.wait(POLL_INTERVAL):
+            return
+        changed = set()
+        for rel, mtime in list(self.mtimes.items()):
+            try:
+                current = os.stat(os.path.join(self.tex_dir, rel)).st_mtime_ns
+            except OSError:
+                current = None
+            if current == mtime:
+                continue
+            changed.add(rel)
+            if current is None:
+                del self.mtimes[rel]
+            else:
+                # New subdirectories are picked up here
+                self.list_tree(rel)
+        if changed:
+            self.mark(changed)
+
+class InotifyWatcher(PollingWatcher):
+
+    #   One inotify watch per directory. wds maps a watch descriptor to the
+    #   relpath of its directory. fd is None once the watcher fell back to
+    #   polling because the tree has more directories than the inotify watch
+    #   limit allows.
+
+    def __init__(self, tex_dir):
+        import ctypes
+        import ctypes.util
+
+        PollingWatcher.__init__(self, tex_dir)
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self.libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.wds = {}
+
+    def add_watch(self, rel):
+        import ctypes
+
+        path = os.path.join(self.tex_dir, rel).encode(sys.getfilesystemencoding(), 'surrogateescape')
+        wd = self.libc.inotify_add_watch(self.fd, path, WATCH_MASK)
+        if wd < 0:
+            e = ctypes.get_errno()
+            if e == errno.ENOENT:
+                return
+            # ENOSPC is the per user watch limit, run falls back to polling
+            raise OSError(e, 'inotify_add_watch failed for %s' % rel)
+        self.wds[wd] = rel
+
+    def add_tree(self, rel):
+        # Watches rel and every directory below it, returns their relpaths
+        added = []
+        stack = [rel]
+        while stack:
+            rel = stack.pop()
+            self.add_watch(rel)
+            added.append(rel)
+            try:
+                with os.scandir(os.path.join(self.tex_dir, rel)) as it:
+                    for de in it:
+                        if not de.name.startswith('.') and de.is_dir():
+                            stack.append(os.path.join(rel, de.name))
+            except OSError:
+                continue
+        return added
+
+    def setup(self):
+        try:
+            self.add_tree('')
+        except OSError:
+            self.close()
+            PollingWatcher.setup(self)
+
+    def poll(self):
+        if self.fd is None:
+            PollingWatcher.poll(self)
+            return
+        ready, _, _ = select.select([self.fd], [], [], 0.5)
+        if not ready:
+            return
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+        self.mark(*self.parse(data))
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def parse(self, data):
+        # Returns (changed directories, whether events were lost)
+        changed = set()
+        full = False
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            name = name.decode(sys.getfilesystemencoding(), 'surrogateescape')
+            offset += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                full = True
+                continue
+            rel = self.wds.get(wd)
+            if rel is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.wds[wd]
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                changed.add(rel)
+                continue
+            if name.startswith('.'):
+                continue
+
+            if mask & IN_ISDIR:
+                sub = os.path.join(rel, name)
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        changed.update(self.add_tree(sub))
+                    except OSError:
+                        full = True
+                changed.add(sub)
+                changed.add(rel)
+            elif name.lower().endswith('.dds'):
+                changed.add(rel)
+        return changed, full
@@ -1,28 +1,84 @@
+import time
+STARTED = time.perf_counter()
+
 import os
 import sys
-import glob
+import multiprocessing
+
+if __name__ == '__main__' and len(sys.argv) > 1:
+    # Headless subcommands, see cli.py. Dispatched before tkinter is imported.
+    multiprocessing.freeze_support()
+    import cli
+    sys.exit(cli.main(sys.argv[1:]))
+
 import json
 import re
-import pandas as pd
-from PIL import Image, ImageTk
+import queue
+import threading
 import tkinter as tk
-from tkinter import filedialog, IntVar, StringVar, Menu, messagebox
+from tkinter import filedialog, simpledialog, IntVar, StringVar, Menu, messagebox
+from tkinter import font as tkfont
+import diagnostics
+
+#   View > Sort By choices, column(s) to sort on and whether ascending.
+#   'path' keeps the order of tex_df, which is sorted by relpath. The sorts
+#   are stable, ties keep the order of the search.
+SORT_OPTIONS = {
+    'path': ('Path', None, True),
+    'hex': ('Hex', ['tex_hex'], True),
+    'format': ('Format', ['tex_format'], True),
+    'dimensions': ('Dimensions', ['tex_width', 'tex_height'], False),
+    'size': ('File Size', ['tex_size'], False),
+    'vram': ('VRAM', ['tex_vram'], False)
+}
+
+#   Options > Search Mode choices
+SEARCH_MODES = {
+    'prefix': 'Prefix',
+    'regex': 'Regex',
+    'fuzzy': 'Fuzzy'
+}
+
+#   View > Minimum Size choices, the longest side of a texture must be at least this
+MIN_DIMENSION_OPTIONS = [0, 1024, 2048, 4096]
 
 class MainWindow:
 
     #   data is a dict which contains:
-    #       tex_dir - the main texture directory
+    #       tex_dirs - every texture directory added to the library
+    #       active_tex_dirs - the ones which are shown, merged into tex_df
     #       options - miscellaneous options
     #   data_path is the path to data.json
-    #   texdirname is a StringVar which copies data['tex_dir']
+    #   texdirname is a StringVar which shows data['active_tex_dirs']
     #   texidname is a StringVar, the id of the current texture from mapping_df
     #   mapping_df is a dataframe derived from final.csv
     #   mapping_df_path is the path to final.csv
+    #   mapping_cache_path is the path to mapping.cache, a binary copy of final.csv
+    #   mapping_index is a texhash -> cardname series built from mapping_df
+    #   mapping_key identifies the final.csv that mapping_df was read from
+    #   manifest_dir holds the cached directory scan of every texture directory
+    #   library is the Library of the active texture directories, relpaths
+    #   in tex_df are relative to library.base
+    #   preview_cache is the PreviewCache used for every 500x500 preview
+    #   preview_loader renders listbox previews off the Tk thread
     #   tex_df is a dataframe which contains:
-    #       tex_relpath - relative path of .dds file
-    #       tex_hex - isolated hex code of .dds file
+    #       tex_dir - directory of .dds file relative to library.base
+    #       tex_name - name of .dds file, empty if it is just tex_hex and .dds
+    #       tex_hex - isolated hex code of .dds file as an integer
     #       tex_id - name of the texture derived from mapping_df
+    #       tex_width, tex_height, tex_format, tex_mips - from the DDS header
+    #       tex_size - file size in bytes
+    #       tex_vram - estimated size of the texture in video memory
+    #       tex_root - the texture directory the file was found in
+    #   relpaths and hex strings of tex_df are rebuilt by the scanner.tex_*
+    #   helpers
+    #   tex_search_df is tex_df filtered by search_query and the View menu
     #   search_query is used to search IDs and hex codes
+    #   search_index is the SearchIndex of tex_df used by the prefix and fuzzy search modes
+    #   search_after is the pending debounced search, if any
+    #   timings holds startup timings in seconds, see report_timings
+    #   pandas, PIL, mapping_df and tex_df are loaded by a background thread
+    #   after the window is shown, see load_async
     
     def __init__(self):
         if getattr(sys, 'frozen', False):
@@ -39,7 +95,19 @@ class MainWindow:
         self.root.grid_columnconfigure(0, weight=1)
 
         self.mapping_df_path = os.path.join(self.application_path, 'csv', 'final.csv')
+        self.mapping_cache_path = os.path.join(self.application_path, 'mapping.cache')
         self.data_path = os.path.join(self.application_path, 'data.json')
+        self.manifest_dir = os.path.join(self.application_path, 'manifests')
+        self.remap_journal_path = os.path.join(self.application_path, 'remap.journal')
+        self.build_state_path = os.path.join(self.application_path, 'build.state')
+        self.catalog_path = os.path.join(self.application_path, 'catalog.sqlite')
+        self.catalog = None
+        self.library = None
+        self.scan_lock = threading.Lock()
+        self.watchers = {}
+        self.watch_pending = None
+        self.watch_queue = queue.Queue()
+        self.watch_busy = False
 
         self.texdirname = StringVar()
         self.texdirname.set('No path selected')
@@ -49,6 +117,9 @@ class MainWindow:
 
         self.search_query = StringVar()
         self.search_query.set('')
+        self.search_after = None
+
+        self.timings = {}
 
         self.load()
         self.draw()
@@ -56,6 +127,8 @@ class MainWindow:
     def save(self):
         with open(self.data_path, 'w', encoding='utf-8') as f:
             json.dump(self.data, f, ensure_ascii=False, indent=4)
+        if self.catalog:
+            self.catalog.save_options(self.data['options'])
     
     def load(self):
         if os.path.isfile(self.data_path):
@@ -66,53 +139,352 @@ class MainWindow:
                 self.data = {}
         else:
             self.data = {}
-        
-        if os.path.isfile(self.mapping_df_path):
-            try:
-                self.mapping_df = pd.read_csv(self.mapping_df_path)
-            except ValueError:
-                messagebox.showwarning('Warning', 'final.csv cannot be found, or does not have the right format.')
-                pd.DataFrame(columns=['hex', 'id'])
-        else:
-            messagebox.showwarning('Warning', 'final.csv cannot be found, or does not have the right format.')
-            pd.DataFrame(columns=['hex', 'id'])
-        
-        if 'tex_dir' in self.data:
-            self.load_folderpath(self.data['tex_dir'])
-        else:
-            self.data['tex_dir'] = ''
-            self.tex_df = pd.DataFrame(columns=['tex_relpath', 'tex_hex', 'tex_id'])
-    
+
         if 'options' not in self.data:
             self.data['options'] = {}
             self.data['options']['flip_image'] = True
-    
-    def load_folderpath(self, folderpath):
-        self.root.withdraw()
-        loading_splash = LoadingSplash(self.root)
+        self.data['options'].setdefault('scan_workers', 8)
+        self.data['options'].setdefault('preview_memory_mb', 128)
+        self.data['options'].setdefault('preview_disk_mb', 2048)
+        self.data['options'].setdefault('prefetch_count', 2)
+        self.data['options'].setdefault('sort_by', 'path')
+        self.data['options'].setdefault('min_dimension', 0)
+        self.data['options'].setdefault('search_mode', 'prefix')
+        self.data['options'].setdefault('search_delay_ms', 150)
+        self.data['options'].setdefault('similar_threshold', 6)
+        self.data['options'].setdefault('use_catalog', False)
+        self.data['options'].setdefault('watch_directory', False)
+
+        if 'tex_dirs' not in self.data:
+            # Single directory versions
+            tex_dir = self.data.pop('tex_dir', '')
+            self.data['tex_dirs'] = [tex_dir] if tex_dir else []
+            self.data['active_tex_dirs'] = list(self.data['tex_dirs'])
+        self.data.setdefault('active_tex_dirs', [])
+
+    def load_async(self):
+        # Imports pandas/PIL, reads final.csv and scans tex_dir on a worker
+        # thread. Tk is only touched from poll_load on the main thread.
+        self.recover_remap()
+        self.load_queue = queue.Queue()
+        self.show_tex_dirs()
+        self.texidname.set('Loading...')
+
+        threading.Thread(target=self.load_worker, args=(list(self.data['active_tex_dirs']),), daemon=True).start()
+        self.root.after(50, self.poll_load)
+
+    def load_worker(self, roots):
+        result = {}
+        try:
+            t = time.perf_counter()
+            import pandas as pd
+            import mapping
+            import library
+            import preview
+            import search
+            # Not used here, imported so draw_preview finds them loaded
+            import PIL.Image
+            import PIL.ImageTk
+            result['import'] = time.perf_counter() - t
+            diagnostics.record('load_import', t, result['import'])
+
+            result['preview_cache'] = preview.PreviewCache(
+                os.path.join(self.application_path, 'previews'),
+                self.data['options']['preview_memory_mb'] * 1024 * 1024,
+                self.data['options']['preview_disk_mb'] * 1024 * 1024
+            )
+            result['preview_loader'] = preview.PreviewLoader(result['preview_cache'])
+
+            t = time.perf_counter()
+            if self.data['options']['use_catalog']:
+                import catalog
+                result['catalog'] = self.catalog or catalog.Catalog(self.catalog_path)
+                if result['catalog'].is_empty() and os.path.isfile(self.mapping_df_path):
+                    result['catalog'].import_csv(self.mapping_df_path)
+                result['mapping_df'] = result['catalog'].load_mapping()
+                result['mapping_key'] = result['catalog'].mapping_key()
+            else:
+                try:
+                    result['mapping_df'] = mapping.load_mapping(self.mapping_df_path, self.mapping_cache_path)
+                except ValueError:
+                    result['mapping_error'] = True
+                    result['mapping_df'] = pd.DataFrame(columns=mapping.MAPPING_COLUMNS)
+                result['mapping_key'] = mapping.mapping_key(self.mapping_df_path)
+            result['mapping_index'] = mapping.build_texhash_index(result['mapping_df'])
+            result['csv'] = time.perf_counter() - t
+            diagnostics.record('load_mapping', t, result['csv'])
+
+            t = time.perf_counter()
+            result['library'] = library.Library(self.manifest_dir, self.data['options']['scan_workers'])
+            try:
+                result['library'].set_roots(roots)
+            except ValueError as e:
+                result['roots_error'] = str(e)
+            result['tex_df'] = result['library'].scan(
+                result['mapping_index'],
+                result['mapping_key'],
+                lambda dirs, files: self.load_queue.put(('progress', (dirs, files)))
+            )
+            if 'catalog' in result:
+                result['catalog'].save_textures(result['tex_df'])
+            result['search_index'] = search.SearchIndex(result['tex_df'], result['mapping_df'])
+            result['scan'] = time.perf_counter() - t
+            diagnostics.record('load_scan', t, result['scan'])
+        except Exception as e:
+            self.load_queue.put(('error', e))
+            return
 
-        self.texdirname.set('Path: ' + folderpath)
-        self.data['tex_dir'] = folderpath
-        fullimgpath = glob.glob(folderpath + '/**/*.[Dd][Dd][Ss]', recursive=True)
-        tex_relpath = [os.path.relpath(fip, folderpath) for fip in fullimgpath]
-        tex_hex = [os.path.basename(rp).split('.')[0] for rp in tex_relpath]
-        tex_id = []
+        self.load_queue.put(('done', result))
 
-        for hx in tex_hex:
+    def poll_load(self):
+        while True:
             try:
-                tex_id.append(self.mapping_df.loc[self.mapping_df['texhash'] == hx]['cardname'].values[0])
-            except (KeyError, IndexError) as e:
-                tex_id.append(None)
-        
-        tex_dict = {'tex_relpath': tex_relpath, 'tex_hex': tex_hex, 'tex_id': tex_id}
-        self.tex_df = pd.DataFrame(tex_dict)
+                kind, value = self.load_queue.get_nowait()
+            except queue.Empty:
+                self.root.after(50, self.poll_load)
+                return
+
+            if kind == 'progress':
+                self.texidname.set('Loading... %d folders, %d files' % value)
+            elif kind == 'error':
+                self.texidname.set('Loading failed')
+                messagebox.showerror('Error', 'Loading failed: %s' % value)
+                return
+            else:
+                self.on_loaded(value)
+                return
+
+    def on_loaded(self, result):
+        import scanner
+
+        if result.get('mapping_error'):
+            messagebox.showwarning('Warning', 'final.csv cannot be found, or does not have the right format.')
+        if result.get('roots_error'):
+            messagebox.showwarning('Warning', 'The texture directories are not loaded: %s' % result['roots_error'])
+
+        self.mapping_df = result['mapping_df']
+        self.mapping_index = result['mapping_index']
+        self.mapping_key = result['mapping_key']
+        self.catalog = result.get('catalog')
+        self.library = result['library']
+        self.preview_cache = result['preview_cache']
+        self.preview_loader = result['preview_loader']
+        self.preview_polling = False
+        self.tex_df = result['tex_df']
         self.tex_search_df = self.tex_df
+        self.search_index = result['search_index']
+        for stage in ('import', 'csv', 'scan'):
+            self.timings[stage] = result[stage]
 
-        loading_splash.destroy()
-        self.root.deiconify()
+        self.texidname.set('No image selected')
+        self.on_update_search(None)
+        if len(self.tex_search_df):
+            self.draw_preview(scanner.tex_relpath_at(self.tex_search_df, 0))
+
+        self.searchbox.config(state=tk.NORMAL)
+        for menu in ('File', 'View', 'Tools'):
+            self.menubar.entryconfig(menu, state=tk.NORMAL)
+        self.options_menu.entryconfig('Search Mode', state=tk.NORMAL)
+
+        self.timings['ready'] = time.perf_counter() - STARTED
+        self.report_timings()
+        self.start_watchers()
+
+    def report_timings(self):
+        # Set WSTONE_TIMINGS=1 to print startup timings to the console
+        if not os.environ.get('WSTONE_TIMINGS'):
+            return
+        print('startup: ' + ', '.join('%s %.3fs' % (k, v) for k, v in self.timings.items()))
+
+    def update_mapping_index(self):
+        import mapping
+
+        self.mapping_index = mapping.build_texhash_index(self.mapping_df)
+        if self.catalog:
+            self.mapping_key = self.catalog.mapping_key()
+        else:
+            self.mapping_key = mapping.mapping_key(self.mapping_df_path)
+
+    def install_mapping(self, mapping_df):
+        # Replaces the whole mapping, in the catalog or in final.csv
+        import mapping
+
+        if self.data['options']['use_catalog'] and self.catalog is None:
+            # A remap recovered before the catalog was loaded
+            import catalog
+            self.catalog = catalog.Catalog(self.catalog_path)
+        if self.catalog:
+            self.catalog.replace_mappings(mapping_df)
+            self.mapping_df = self.catalog.load_mapping()
+        else:
+            self.mapping_df = mapping.save_mapping(mapping_df, self.mapping_df_path, self.mapping_cache_path)
+        self.update_mapping_index()
+
+    def show_tex_dirs(self):
+        roots = self.data['active_tex_dirs']
+        if not roots:
+            self.texdirname.set('No path selected')
+        elif len(roots) == 1:
+            self.texdirname.set('Path: ' + roots[0])
+        else:
+            self.texdirname.set('Paths: %d directories' % len(roots))
+
+    def load_roots(self, roots, walk=True):
+        # Makes roots the active texture directories. With walk False, a
+        # directory which was scanned before in this session is not walked
+        # again. Raises ValueError if a directory is inside another one.
+        import search
+
+        # The splash runs pending events before its grab, so it is built
+        # before scan_lock is taken
+        self.root.withdraw()
+        loading_splash = LoadingSplash(self.root)
+        try:
+            # Roots and scanners change together, a watcher refresh must not
+            # merge the new roots with the old scans
+            with self.scan_lock:
+                self.library.set_roots(roots)
+
+                self.data['active_tex_dirs'] = list(roots)
+                for root in roots:
+                    if root not in self.data['tex_dirs']:
+                        self.data['tex_dirs'].append(root)
+                self.show_tex_dirs()
+                self.library.workers = self.data['options']['scan_workers']
+                self.tex_df = self.library.scan(self.mapping_index, self.mapping_key, loading_splash.set_progress, walk)
+            if self.catalog:
+                self.catalog.save_textures(self.tex_df)
+            self.tex_search_df = self.tex_df
+            self.search_index = search.SearchIndex(self.tex_df, self.mapping_df)
+        finally:
+            loading_splash.destroy()
+            self.root.deiconify()
+        self.data['options']['watch_directory'] = self.watch_directory.get()
+        self.save()
+        self.start_watchers()
+
+    def start_watchers(self):
+        # Watches every active texture directory if Watch Directory is on,
+        # keeping the watchers of directories which stay active
+        import watcher
+
+        roots = self.library.roots if self.library and self.data['options']['watch_directory'] else []
+        for root in list(self.watchers):
+            if root not in roots:
+                self.watchers.pop(root).stop()
+        self.watch_pending = {}
+        for root in roots:
+            if root not in self.watchers:
+                self.watchers[root] = watcher.create_watcher(root)
+                self.watchers[root].start()
+                self.root.after(250, self.poll_watcher, self.watchers[root])
+
+    def poll_watcher(self, watcher):
+        # Collects batches of the watcher and refreshes tex_df on a worker
+        # thread, one refresh at a time. Batches arriving meanwhile are
+        # merged and applied by the next refresh.
+        root = watcher.tex_dir
+        if self.watchers.get(root) is not watcher:
+            return
+
+        batch = watcher.changes()
+        if batch:
+            full, rels = self.watch_pending.get(root, (False, set()))
+            self.watch_pending[root] = (full or batch[0], rels | batch[1])
+
+        try:
+            kind, value = self.watch_queue.get_nowait()
+            self.watch_busy = False
+            if kind == 'error':
+                messagebox.showerror('Error', 'Refreshing the texture list failed: %s' % value)
+            else:
+                self.apply_refresh(*value)
+        except queue.Empty:
+            pass
+
+        if self.watch_pending and not self.watch_busy:
+            self.watch_busy = True
+            threading.Thread(target=self.refresh_worker, args=(self.watch_pending, self.list_view()), daemon=True).start()
+            self.watch_pending = {}
+
+        self.root.after(250, self.poll_watcher, watcher)
+
+    def list_view(self):
+        # (search query, options, selected relpath) of the list, a refresh
+        # builds its list for these
+        import scanner
+
+        selected = self.listbox.curselection()
+        relpath = scanner.tex_relpath_at(self.tex_search_df, selected[0]) if selected else None
+        return self.search_query.get(), dict(self.data['options']), relpath
+
+    def refresh_worker(self, changes, view):
+        # Always puts one message on watch_queue, poll_watcher only starts
+        # the next refresh once it got it. Everything but swapping in the
+        # results is done here, off the Tk thread.
+        import catalog
+        import scanner
+        import search
+
+        try:
+            with self.scan_lock:
+                tex_df = self.library.refresh(changes, self.mapping_index, self.mapping_key)
+            search_index = search.SearchIndex(tex_df, self.mapping_df)
+            hashes = catalog.texture_hashes(tex_df) if self.catalog else None
+
+            sq, options, relpath = view
+            tex_search_df = self.search(tex_df, search_index, sq, options)
+            row = None
+            if relpath is not None and tex_search_df is not None:
+                relpaths = scanner.tex_relpaths(tex_search_df)
+                if relpath in relpaths:
+                    row = relpaths.index(relpath)
+            self.watch_queue.put(('done', (tex_df, search_index, hashes, view, tex_search_df, row)))
+        except Exception as e:
+            self.watch_queue.put(('error', e))
+
+    def apply_refresh(self, tex_df, search_index, hashes, view, tex_search_df, row):
+        # Swaps in a refreshed tex_df, keeping the selection and the scroll
+        # position of the list
+        import scanner
+
+        if tex_df is self.tex_df or tex_df is not self.library.tex_df:
+            # Nothing changed, or a reload came in since
+            return
+
+        current = self.list_view()
+        first = self.listbox.first
+
+        self.tex_df = tex_df
+        self.search_index = search_index
+        if self.catalog:
+            self.catalog.save_textures(tex_df, hashes)
+
+        if current != view or tex_search_df is None:
+            # The search or the selection changed while the refresh ran
+            self.on_update_search(None)
+            row = None
+            relpath = current[2]
+            if relpath is not None:
+                relpaths = scanner.tex_relpaths(self.tex_search_df)
+                if relpath in relpaths:
+                    row = relpaths.index(relpath)
+        else:
+            self.tex_search_df = tex_search_df
+            self.listbox.set_items(HexLabels(tex_search_df))
+
+        self.listbox.first = max(0, min(first, len(self.tex_search_df) - self.listbox.page_rows()))
+        if row is not None:
+            self.listbox.selection_set(row)
+        self.listbox.redraw()
+
+    def set_watch_directory(self):
+        self.data['options']['watch_directory'] = self.watch_directory.get()
+        self.save()
+        self.start_watchers()
 
     def reload(self):
-        self.load_folderpath(self.data['tex_dir'])
+        self.load_roots(self.data['active_tex_dirs'])
         self.on_update_search(None)
 
     def draw(self):
@@ -123,65 +495,96 @@ class MainWindow:
         right_frame.grid(row=0, column=1, padx=5, pady=5, sticky='nsew')
         
         menubar = Menu(self.root)
+        self.menubar = menubar
     
         fileMenu = Menu(menubar, tearoff=0)
         fileMenu.add_command(label='Open Texture Directory...', command=self.open_folder)
+        fileMenu.add_command(label='Add Texture Directory...', command=self.add_folder)
+        fileMenu.add_command(label='Texture Directories...', command=self.manage_folders)
         fileMenu.add_command(label='Reload Directory', command=self.reload)
+        fileMenu.add_separator()
+        fileMenu.add_command(label='Import Mapping CSV...', command=self.import_mapping)
+        fileMenu.add_command(label='Export Mapping CSV...', command=self.export_mapping)
         menubar.add_cascade(label='File', menu=fileMenu)
 
+        viewMenu = Menu(menubar, tearoff=0)
+        self.sort_by = StringVar()
+        self.sort_by.set(self.data['options']['sort_by'])
+        sortMenu = Menu(viewMenu, tearoff=0)
+        for key, (label, columns, ascending) in SORT_OPTIONS.items():
+            sortMenu.add_radiobutton(label=label, value=key, variable=self.sort_by, command=self.on_view_change)
+        viewMenu.add_cascade(label='Sort By', menu=sortMenu)
+
+        self.min_dimension = IntVar()
+        self.min_dimension.set(self.data['options']['min_dimension'])
+        sizeMenu = Menu(viewMenu, tearoff=0)
+        for dimension in MIN_DIMENSION_OPTIONS:
+            label = '%d px' % dimension if dimension else 'All'
+            sizeMenu.add_radiobutton(label=label, value=dimension, variable=self.min_dimension, command=self.on_view_change)
+        viewMenu.add_cascade(label='Minimum Size', menu=sizeMenu)
+        viewMenu.add_separator()
+        viewMenu.add_command(label='Directory Stats...', command=self.show_stats)
+        menubar.add_cascade(label='View', menu=viewMenu)
+
         toolsMenu = Menu(menubar, tearoff=0)
         toolsMenu.add_command(label='Find Duplicates', command=self.find_duplicates)
+        toolsMenu.add_command(label='Find Similar Textures...', command=self.find_similar)
+        toolsMenu.add_command(label='Warm Preview Cache', command=self.warm_preview_cache)
         toolsMenu.add_command(label='Remap...', command=self.remap)
+        toolsMenu.add_command(label='Rebuild Mapping', command=self.rebuild_mapping)
         menubar.add_cascade(label='Tools', menu=toolsMenu)
     
         optionsMenu = Menu(menubar, tearoff=0)
         optionsMenu.add_command(label='Flip Image', command=self.set_flip_image)
+        optionsMenu.add_command(label='Scan Threads...', command=self.set_scan_workers)
+        self.use_catalog = tk.BooleanVar()
+        self.use_catalog.set(self.data['options']['use_catalog'])
+        optionsMenu.add_checkbutton(label='Use SQLite Catalog', variable=self.use_catalog, command=self.set_use_catalog)
+        self.watch_directory = tk.BooleanVar()
+        self.watch_directory.set(self.data['options']['watch_directory'])
+        optionsMenu.add_checkbutton(label='Watch Directory', variable=self.watch_directory, command=self.set_watch_directory)
+        optionsMenu.add_separator()
+        optionsMenu.add_command(label='Diagnostics...', command=lambda: DiagnosticsWindow(self.root))
+        self.search_mode = StringVar()
+        self.search_mode.set(self.data['options']['search_mode'])
+        searchMenu = Menu(optionsMenu, tearoff=0)
+        for key, label in SEARCH_MODES.items():
+            searchMenu.add_radiobutton(label=label, value=key, variable=self.search_mode, command=self.set_search_mode)
+        optionsMenu.add_cascade(label='Search Mode', menu=searchMenu)
+        self.options_menu = optionsMenu
         menubar.add_cascade(label='Options', menu=optionsMenu)
     
         self.root.config(menu=menubar)
-    
-        try:
-            im = Image.open(os.path.join(self.data['tex_dir'], self.tex_df['tex_relpath'][0]))
-            im = im.resize((500, 500), Image.LANCZOS)
-            if self.data['options']['flip_image']:
-                im = im.transpose(Image.FLIP_TOP_BOTTOM)
-            self.photo_image = ImageTk.PhotoImage(im)
-        except KeyError:
-            im = Image.new('RGB', (500, 500))
-            self.photo_image = ImageTk.PhotoImage(im)
+        # Enabled once load_async is done
+        menubar.entryconfig('File', state=tk.DISABLED)
+        menubar.entryconfig('View', state=tk.DISABLED)
+        menubar.entryconfig('Tools', state=tk.DISABLED)
+        optionsMenu.entryconfig('Search Mode', state=tk.DISABLED)
+
+        # A plain PhotoImage so PIL does not have to be imported yet
+        self.photo_image = tk.PhotoImage(width=500, height=500)
+        self.photo_image.put('black', to=(0, 0, 500, 500))
         
         self.searchbox = tk.Entry(
             left_frame, 
             width=30,
-            textvariable=self.search_query
+            textvariable=self.search_query,
+            state=tk.DISABLED
         )
 
-        self.searchbox.bind('<KeyRelease>', self.on_update_search)
+        self.searchbox.bind('<KeyRelease>', self.on_search_key)
         self.searchbox.pack(side=tk.TOP)
     
-        self.listbox = tk.Listbox(
+        self.listbox = VirtualListbox(
             left_frame, 
-            bg = 'white',
-            activestyle = 'dotbox',
-            yscrollcommand = tk.Scrollbar.set
+            bg = 'white'
         )
     
         self.listbox.bind('<<ListboxSelect>>', self.on_select)
 
-        listscrollbar = tk.Scrollbar(self.listbox)
-        listscrollbar.pack(side = tk.RIGHT, fill = tk.BOTH)
-        self.listbox.config(yscrollcommand = listscrollbar.set)
-        listscrollbar.config(command = self.listbox.yview)
-
         aqua = self.root.tk.call('tk', 'windowingsystem') == 'aqua'
         # self.listbox.bind('<2>' if aqua else '<3>', self.on_right_click)
 
-        try:
-            for img in self.tex_df['tex_hex']:
-                self.listbox.insert(tk.END, img)
-        except KeyError:
-            pass
-    
         self.listbox.pack(fill='both', expand=True)
     
         dirlabel = tk.Label(
@@ -229,7 +632,11 @@ class MainWindow:
             padx=5,
             pady=5
         )
-    
+
+        self.root.update()
+        self.timings['first_paint'] = time.perf_counter() - STARTED
+
+        self.load_async()
         self.root.mainloop()
 
     def open_folder(self):
@@ -238,25 +645,87 @@ class MainWindow:
         if not folderpath or not os.path.exists(folderpath):
             return
         
-        self.load_folderpath(folderpath)
-        self.save()
-        self.listbox.delete(0, tk.END)
-        for img in self.tex_df['tex_hex']:
-            self.listbox.insert(tk.END, img)
+        self.load_roots([os.path.abspath(folderpath)], walk=False)
+        self.on_update_search(None)
+
+    def add_folder(self):
+        folderpath = filedialog.askdirectory()
+
+        if not folderpath or not os.path.exists(folderpath):
+            return
+
+        try:
+            self.load_roots(self.data['active_tex_dirs'] + [os.path.abspath(folderpath)], walk=False)
+        except ValueError as e:
+            messagebox.showerror('Error', str(e))
+            return
+        self.on_update_search(None)
+
+    def manage_folders(self):
+        # Texture Directories window, the selected directories are active
+        window = TexDirsWindow(self.root, self.data['tex_dirs'], self.data['active_tex_dirs'])
+        if window.result is None:
+            return
+
+        tex_dirs, active = window.result
+        self.data['tex_dirs'] = tex_dirs
+        try:
+            self.load_roots(active, walk=False)
+        except ValueError as e:
+            messagebox.showerror('Error', str(e))
+            return
+        self.on_update_search(None)
 
     def listbox_focus(self, index):
-        im = Image.open(os.path.join(self.data['tex_dir'], self.tex_search_df['tex_relpath'][index] ))
+        import scanner
 
-        if self.tex_search_df['tex_id'][index] is not None:
-            self.texidname.set('ID: ' + self.tex_search_df['tex_id'][index])
+        tex_id = self.tex_search_df['tex_id'].iloc[index]
+        if isinstance(tex_id, str):
+            self.texidname.set('ID: ' + tex_id)
         else:
             self.texidname.set('No ID set')
-        
-        im = im.resize((500, 500), Image.LANCZOS)
-        if self.data['options']['flip_image']:
-            im = im.transpose(Image.FLIP_TOP_BOTTOM)
-        self.photo_image = ImageTk.PhotoImage(im)
-        self.canvas.itemconfigure(self.image_output, image=self.photo_image)
+
+        # Neighbours in the order the user is likely to reach them
+        n = self.data['options']['prefetch_count']
+        neighbours = []
+        for distance in range(1, n + 1):
+            for i in (index + distance, index - distance):
+                if 0 <= i < len(self.tex_search_df):
+                    neighbours.append(scanner.tex_relpath_at(self.tex_search_df, i))
+
+        self.draw_preview(scanner.tex_relpath_at(self.tex_search_df, index), neighbours)
+
+    def draw_preview(self, relpath, prefetch=()):
+        # Rendered by preview_loader, poll_preview puts the result on the canvas
+        tex_dir = self.library.base
+        self.preview_requested = time.perf_counter()
+        self.preview_loader.request(
+            os.path.join(tex_dir, relpath),
+            self.data['options']['flip_image'],
+            [os.path.join(tex_dir, rp) for rp in prefetch]
+        )
+        if not self.preview_polling:
+            self.preview_polling = True
+            self.root.after(10, self.poll_preview)
+
+    def poll_preview(self):
+        from PIL import ImageTk
+
+        done, im = self.preview_loader.poll()
+        if not done:
+            self.root.after(10, self.poll_preview)
+            return
+
+        self.preview_polling = False
+        with diagnostics.span('preview_show'):
+            if isinstance(im, Exception):
+                self.photo_image = tk.PhotoImage(width=500, height=500)
+                self.photo_image.put('black', to=(0, 0, 500, 500))
+            else:
+                self.photo_image = ImageTk.PhotoImage(im)
+            self.canvas.itemconfigure(self.image_output, image=self.photo_image)
+        # From the request to the preview being on screen
+        diagnostics.record('preview_latency', self.preview_requested, time.perf_counter() - self.preview_requested)
 
     def on_select(self, evt):
         # evt is an event object
@@ -267,63 +736,337 @@ class MainWindow:
         index = int(curselection[0])
         self.listbox_focus(index)
 
+    def on_search_key(self, evt):
+        # Debounced, only the last key of a burst runs the search
+        if self.search_after is not None:
+            self.root.after_cancel(self.search_after)
+        self.search_after = self.root.after(self.data['options']['search_delay_ms'], self.on_update_search, None)
+
     def on_update_search(self, evt):
-        sq = self.search_query.get()
-        if sq:
+        self.search_after = None
+        with diagnostics.span('search'):
+            tex_search_df = self.search(self.tex_df, self.search_index, self.search_query.get(), self.data['options'])
+        if tex_search_df is None:
+            return
+        self.tex_search_df = tex_search_df
+        with diagnostics.span('listbox_fill'):
+            self.listbox.set_items(HexLabels(self.tex_search_df))
+
+    def search(self, tex_df, search_index, sq, options):
+        # Rows of tex_df matching sq in the search mode and view of options,
+        # None if sq is not a valid regex. Only reads its arguments, so a
+        # refresh can run it on its worker thread.
+        import search
+
+        ranked = False
+        if not sq:
+            search_df = tex_df
+        elif options['search_mode'] == 'regex':
             try:
-                df1 = self.tex_df[self.tex_df['tex_id'].str.match(sq, na=False)]
-                df2 = self.tex_df[self.tex_df['tex_hex'].str.match(sq, na=False)]
-            except re.error: 
-                return
-            
-            self.tex_search_df = pd.concat([df1, df2], ignore_index=True, sort=False).drop_duplicates(keep='first')
-            self.tex_search_df.reset_index(inplace = True, drop = True)
-            self.listbox.delete(0, tk.END)
-            for img in self.tex_search_df['tex_hex']:
-                self.listbox.insert(tk.END, img)
+                search_df = search.regex(tex_df, sq)
+            except re.error:
+                return None
+        elif options['search_mode'] == 'fuzzy':
+            # Ranked best first, so the view filter is applied before the
+            # cut to FUZZY_LIMIT and the sort is skipped
+            rows = search_index.fuzzy(sq, mask=self.view_mask(tex_df, options))
+            search_df = tex_df.iloc[rows]
+            ranked = True
         else:
-            self.listbox.delete(0, tk.END)
-            self.tex_search_df = self.tex_df
-            for img in self.tex_df['tex_hex']:
-                self.listbox.insert(tk.END, img)
+            search_df = tex_df.iloc[search_index.prefix(sq)]
+
+        search_df = self.apply_view(search_df, options, ranked)
+        # Listbox indices are used as labels, so the result has a RangeIndex
+        if search_df is not tex_df:
+            search_df = search_df.reset_index(drop=True)
+        return search_df
+
+    def view_mask(self, df, options):
+        # Rows of df passing the min size filter of the View menu, None
+        # without a filter
+        min_dimension = options['min_dimension']
+        if not min_dimension:
+            return None
+        return ((df['tex_width'] >= min_dimension) | (df['tex_height'] >= min_dimension)).to_numpy()
+
+    def apply_view(self, df, options, ranked=False):
+        # Filter and sort chosen in the View menu. ranked results are
+        # already filtered and keep their order.
+        if not ranked:
+            mask = self.view_mask(df, options)
+            if mask is not None:
+                df = df[mask]
+
+            label, columns, ascending = SORT_OPTIONS.get(options['sort_by'], SORT_OPTIONS['path'])
+            if columns:
+                df = df.sort_values(columns, ascending=ascending, kind='stable')
+        return df
+
+    def on_view_change(self):
+        self.data['options']['sort_by'] = self.sort_by.get()
+        self.data['options']['min_dimension'] = self.min_dimension.get()
+        self.save()
+        self.on_update_search(None)
+
+    def show_stats(self):
+        import scanner
+
+        stats = scanner.directory_stats(self.tex_df)
+        formats = '\n'.join('    %s: %d' % (fmt, count) for fmt, count in stats['formats'].items() if count)
+        messagebox.showinfo(
+            'Directory Stats',
+            'Files: %d\nSize on disk: %s\nEstimated VRAM: %s\n4K textures: %d\n\nFormats:\n%s' % (
+                stats['files'],
+                format_bytes(stats['size']),
+                format_bytes(stats['vram']),
+                stats['4k'],
+                formats
+            )
+        )
+
+    def set_search_mode(self):
+        self.data['options']['search_mode'] = self.search_mode.get()
+        self.save()
+        self.on_update_search(None)
 
     def set_flip_image(self):
         self.data['options']['flip_image'] = not self.data['options']['flip_image']
 
+    def set_use_catalog(self):
+        self.data['options']['use_catalog'] = self.use_catalog.get()
+        self.save()
+        messagebox.showinfo('Information', 'The change takes effect on the next start.')
+
+    def set_scan_workers(self):
+        workers = simpledialog.askinteger(
+            'Scan Threads',
+            'Number of threads used to scan the texture directory.',
+            initialvalue=self.data['options']['scan_workers'],
+            minvalue=1,
+            maxvalue=64,
+            parent=self.root
+        )
+        if workers:
+            self.data['options']['scan_workers'] = workers
+            self.save()
+
     def find_duplicates(self):
-        dupewindow = DupeWindow(self.root, self.data, self.tex_df)
+        import dupes
+
+        loading_splash = LoadingSplash(self.root)
+        try:
+            # A watcher refresh must not change the scanners meanwhile
+            with self.scan_lock:
+                records = dict(self.library.records())
+                groups = dupes.find_duplicates(
+                    self.library.base,
+                    self.tex_df,
+                    records,
+                    self.data['options']['scan_workers'],
+                    lambda done, total: done % 100 == 0 and loading_splash.set_message('Hashing files...\n%d / %d' % (done, total))
+                )
+                # Keep the hashes for the next run
+                self.library.save_manifests(records)
+        except OSError as e:
+            messagebox.showerror('Error', 'Finding duplicates failed: %s' % e)
+            return
+        finally:
+            loading_splash.destroy()
+
+        if not groups:
+            messagebox.showinfo('Information', 'No duplicates found.')
+            return
+
+        dupewindow = DupeWindow(self.root, self.library.base, self.data, groups, self.preview_cache)
+        self.reload()
+
+    def find_similar(self):
+        import dupes
+
+        threshold = simpledialog.askinteger(
+            'Find Similar Textures',
+            'Maximum number of differing bits (0-%d) between the image hashes.' % dupes.MAX_SIMILAR_THRESHOLD,
+            initialvalue=min(self.data['options']['similar_threshold'], dupes.MAX_SIMILAR_THRESHOLD),
+            minvalue=0,
+            maxvalue=dupes.MAX_SIMILAR_THRESHOLD,
+            parent=self.root
+        )
+        if threshold is None:
+            return
+        self.data['options']['similar_threshold'] = threshold
+        self.save()
+
+        loading_splash = LoadingSplash(self.root)
+        try:
+            with self.scan_lock:
+                records = dict(self.library.records())
+                groups = dupes.find_similar(
+                    self.library.base,
+                    self.tex_df,
+                    records,
+                    threshold,
+                    progress=lambda done, total: done % 100 == 0 and loading_splash.set_message('Hashing images...\n%d / %d' % (done, total))
+                )
+                self.library.save_manifests(records)
+        except OSError as e:
+            messagebox.showerror('Error', 'Finding similar textures failed: %s' % e)
+            return
+        finally:
+            loading_splash.destroy()
+
+        if not groups:
+            messagebox.showinfo('Information', 'No similar textures found.')
+            return
+
+        dupewindow = DupeWindow(self.root, self.library.base, self.data, groups, self.preview_cache)
         self.reload()
+
+    def warm_preview_cache(self):
+        import scanner
+
+        loading_splash = LoadingSplash(self.root)
+        try:
+            paths = [os.path.join(self.library.base, rp) for rp in scanner.tex_relpaths(self.tex_df)]
+            self.preview_cache.warm(
+                paths,
+                self.data['options']['flip_image'],
+                progress=lambda done, total: loading_splash.set_message('Rendering previews...\n%d / %d' % (done, total))
+            )
+        finally:
+            loading_splash.destroy()
     
+    def import_mapping(self):
+        import remap
+
+        mapping_file = filedialog.askopenfilename(filetypes=[('CSV files', '*.csv')])
+        if not mapping_file:
+            return
+        try:
+            mapping_df = remap.read_mapping(mapping_file)
+        except ValueError:
+            messagebox.showerror('Error', 'Invalid .csv file.')
+            return
+
+        self.install_mapping(mapping_df)
+        self.reload()
+
+    def rebuild_mapping(self):
+        # Regenerates final.csv from the source tables in csv/
+        import sqlite3
+        import builder
+
+        loading_splash = LoadingSplash(self.root)
+        try:
+            loading_splash.set_message('Rebuilding mapping...')
+            mapping_df, report = builder.build(os.path.dirname(self.mapping_df_path), self.build_state_path)
+            self.install_mapping(mapping_df)
+        except (ValueError, OSError, sqlite3.Error) as e:
+            messagebox.showerror('Error', 'Rebuilding the mapping failed: %s' % e)
+            return
+        finally:
+            loading_splash.destroy()
+        self.reload()
+        messagebox.showinfo(
+            'Information',
+            '%d mappings built.\nChanged tables: %s\nCards rebuilt: %d\nTextures rehashed: %d' % (
+                len(mapping_df),
+                ', '.join(report['changed']) or 'none',
+                report['guids'],
+                report['texnames']
+            )
+        )
+
+    def export_mapping(self):
+        import mapping
+
+        mapping_file = filedialog.asksaveasfilename(defaultextension='.csv', filetypes=[('CSV files', '*.csv')])
+        if not mapping_file:
+            return
+        if self.catalog:
+            self.catalog.export_csv(mapping_file)
+        else:
+            mapping.csv_frame(self.mapping_df).to_csv(mapping_file, index=False)
+
     def remap(self):
+        import remap
+
         messagebox.showinfo('Information', 'Select mapping .csv file.')
         remap_file = filedialog.askopenfilename(filetypes =[('CSV files', '*.csv')])
-        new_mapping_df = pd.DataFrame()
 
         if not remap_file or not os.path.exists(remap_file):
             messagebox.showerror('Error', 'Invalid .csv file.')
             return
-        
+
         try:
-            new_mapping_df = pd.read_csv(remap_file)
-            self.mapping_df.rename(columns={"texhash": "old_texhash"})
-        except (pd.errors.EmptyDataError, pd.errors.ParserError, KeyError) as e:
+            new_mapping_df = remap.read_mapping(remap_file)
+        except ValueError:
             messagebox.showerror('Error', 'Invalid .csv file.')
             return
-        
+
+        with diagnostics.span('remap_plan'):
+            plan = remap.RemapPlan(self.library.base, self.tex_df, self.mapping_df, new_mapping_df)
+        report = plan.report()
+        answer = messagebox.askyesnocancel(
+            'Remap',
+            '\n'.join(report[:2]) + '\n\nYes: rename the files and install the new mapping.\nNo: save the dry run report.'
+        )
+        if answer is None:
+            return
+        if not answer:
+            report_file = filedialog.asksaveasfilename(defaultextension='.txt', filetypes=[('Text files', '*.txt')])
+            if report_file:
+                with open(report_file, 'w', encoding='utf-8') as f:
+                    f.write('\n'.join(report) + '\n')
+            return
+
+        loading_splash = LoadingSplash(self.root)
         try:
-            merged_df = new_mapping_df.merge(self.mapping_df, how='left', on=['guid', 'cardname', 'texname'])
-            new_mapping_dict = pd.Series(merged_df['texhash'].values,index=merged_df['old_texhash']).to_dict()
-            self.tex_df['tex_hex'] = self.tex_df['tex_id'].map(new_mapping_dict).fillna(self.tex_df['tex_hex'])
-
-            for index, row in self.tex_df.iterrows():
-                new_relpath = os.path.join(os.path.dirname(row['tex_relpath']), row['tex_hex'] + '.dds')
-                os.rename(os.path.join(self.data['tex_dir'], row['tex_relpath']), os.path.join(self.data['tex_dir'], new_relpath))
-        except KeyError:
-            pass
+            remap.execute(
+                plan,
+                self.remap_journal_path,
+                remap_file,
+                lambda done, total: loading_splash.set_message('Renaming files...\n%d / %d' % (done, total))
+            )
+        except OSError as e:
+            loading_splash.destroy()
+            messagebox.showerror('Error', 'Remap stopped: %s' % e)
+            self.recover_remap()
+            self.reload()
+            return
+        loading_splash.destroy()
 
-        new_mapping_df.to_csv(self.mapping_df_path, index=False)
+        self.install_mapping(new_mapping_df)
+        remap.remove_journal(self.remap_journal_path)
         self.reload()
 
+    def recover_remap(self):
+        # Offers to finish or undo a remap which did not complete. Runs on
+        # the Tk thread at start, so remap (and pandas with it) is only
+        # imported if there is a journal.
+        if not os.path.exists(self.remap_journal_path):
+            return
+        import remap
+
+        journal = remap.load_journal(self.remap_journal_path)
+        if journal is None:
+            return
+
+        answer = messagebox.askyesno(
+            'Remap',
+            'A remap of %s did not complete (%d of %d renames done).\n\n'
+            'Yes: finish the remap.\nNo: undo the renames.' % (journal['tex_dir'], journal['done'], len(journal['steps']))
+        )
+        try:
+            if answer:
+                remap.roll_forward(journal, self.remap_journal_path)
+                if journal['mapping_path']:
+                    self.install_mapping(remap.read_mapping(journal['mapping_path']))
+                remap.remove_journal(self.remap_journal_path)
+            else:
+                remap.roll_back(journal, self.remap_journal_path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror('Error', 'Remap recovery failed: %s' % e)
+
     def on_right_click(self, evt):
         widget = evt.widget
         self.right_click_index = widget.nearest(evt.y)
@@ -373,37 +1116,63 @@ class MainWindow:
             return None
             
     def right_click_change_hex(self):
-        curr_relpath = self.tex_search_df['tex_relpath'][self.right_click_index]
-        curr_hex = self.tex_search_df['tex_hex'][self.right_click_index]
-        curr_id = self.tex_search_df['tex_id'][self.right_click_index]
+        import mapping
+        import scanner
+
+        curr_relpath = scanner.tex_relpath_at(self.tex_search_df, self.right_click_index)
+        curr_hex = scanner.tex_hex_of(curr_relpath)
+        curr_id = self.tex_search_df['tex_id'].iloc[self.right_click_index]
         
         output = self.right_click_draw('Enter new hex code.', curr_hex)
 
         if output:
-            full_path = os.path.join(self.data['tex_dir'], self.tex_search_df['tex_relpath'][self.right_click_index])
-            os.rename(full_path, os.path.join(self.data['tex_dir'], os.path.dirname(curr_relpath), output + '.dds'))
+            full_path = os.path.join(self.library.base, curr_relpath)
+            os.rename(full_path, os.path.join(self.library.base, os.path.dirname(curr_relpath), output + '.dds'))
 
             try:
-                search_index = self.mapping_df.loc[(self.mapping_df['hex'] == curr_hex) & (self.mapping_df['id'] == curr_id)].index[0]
-                self.mapping_df['hex'][search_index] = output
+                same_hex = (self.mapping_df['texhash'] == self.tex_search_df['tex_hex'].iloc[self.right_click_index]).fillna(False)
+                search_index = self.mapping_df.loc[same_hex & (self.mapping_df['cardname'] == curr_id)].index[0]
+                self.mapping_df.at[search_index, 'texhash'] = mapping.parse_hex([output])[0]
             except IndexError:
-                pass
+                search_index = None
             
-            self.mapping_df.to_csv(self.mapping_df_path, index=False)
+            if self.catalog:
+                if search_index is not None:
+                    self.catalog.set_texhash(search_index, output)
+            else:
+                self.mapping_df = mapping.save_mapping(self.mapping_df, self.mapping_df_path, self.mapping_cache_path)
+            self.update_mapping_index()
             self.reload()
     
     def right_click_delete_entry(self):
+        import scanner
+
         response = tk.messagebox.askyesno(title='confirmation', message='Are you sure you want to delete this file?')
 
         if not response:
             return
         
-        full_path = os.path.join(self.data['tex_dir'], self.tex_search_df['tex_relpath'][self.right_click_index])
+        full_path = os.path.join(self.library.base, scanner.tex_relpath_at(self.tex_search_df, self.right_click_index))
         os.remove(full_path)
         self.reload()
 
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return '%.1f %s' % (size, unit)
+        size /= 1024
+    return '%.1f TB' % size
+
 class DupeWindow:
-    def __init__(self, root, data, tex_df):
+
+    #   groups is the report of dupes.find_duplicates or dupes.find_similar,
+    #   with relpaths relative to tex_dir.
+    #   The window pages through it, comparing the kept file of each group
+    #   with the others.
+
+    def __init__(self, root, tex_dir, data, groups, preview_cache):
+        from PIL import ImageTk
+
         self.dupe_window = tk.Toplevel(root)
         self.dupe_window.resizable(False, False)
         self.dupe_window.title('Duplicate Finder')
@@ -413,28 +1182,30 @@ class DupeWindow:
         self.dupe_window.grid_columnconfigure(2, weight=1)
 
         self.draw()
-        self.modified_tex_df = pd.DataFrame()
 
-        name_dict = {}
-        for i in tex_df['tex_relpath']:
-            hex = tex_df.loc[tex_df['tex_relpath'] == i]['tex_hex'].values[0]
-            if hex not in name_dict:
-                name_dict[hex] = i
+        for group_index, group in enumerate(groups):
+            if group['kind'] == 'content':
+                description = 'identical files'
+            elif group['kind'] == 'similar':
+                description = 'similar images'
             else:
-                self.dupe_text_1.set(name_dict[hex])
+                description = 'same hex code ' + group['key']
+            self.group_text.set('Group %d of %d: %s' % (group_index + 1, len(groups), description))
+
+            relpaths = [rp for rp in group['relpaths'] if os.path.exists(os.path.join(tex_dir, rp))]
+            if len(relpaths) < 2:
+                continue
+
+            keep = relpaths[0]
+            for i in relpaths[1:]:
+                self.dupe_text_1.set(keep)
                 self.dupe_text_2.set(i)
 
-                im1 = Image.open(os.path.join(data['tex_dir'], name_dict[hex]))
-                im1 = im1.resize((500, 500), Image.LANCZOS)
-                if data['options']['flip_image']:
-                    im1 = im1.transpose(Image.FLIP_TOP_BOTTOM)
+                im1 = preview_cache.get(os.path.join(tex_dir, keep), data['options']['flip_image'])
                 photo_image_1 = ImageTk.PhotoImage(im1)
                 self.comp_canvas_1.itemconfigure(self.dupe_output_1, image=photo_image_1)
 
-                im2 = Image.open(os.path.join(data['tex_dir'], i))
-                im2 = im2.resize((500, 500), Image.LANCZOS)
-                if data['options']['flip_image']:
-                    im2 = im2.transpose(Image.FLIP_TOP_BOTTOM)
+                im2 = preview_cache.get(os.path.join(tex_dir, i), data['options']['flip_image'])
                 photo_image_2 = ImageTk.PhotoImage(im2)
                 self.comp_canvas_2.itemconfigure(self.dupe_output_2, image=photo_image_2)
 
@@ -442,18 +1213,18 @@ class DupeWindow:
 
                 if self.dupe_wait_var.get() == 1:
                     # Delete 2
-                    os.remove(os.path.join(data['tex_dir'], i))
-                    tex_df = tex_df[tex_df.tex_relpath != i]
+                    os.remove(os.path.join(tex_dir, i))
                 elif self.dupe_wait_var.get() == 2:
                     # Delete 1
-                    os.remove(os.path.join(data['tex_dir'], name_dict[hex]))
-                    tex_df = tex_df[tex_df.tex_relpath != name_dict[hex]]
-                    name_dict[hex] = i
+                    os.remove(os.path.join(tex_dir, keep))
+                    keep = i
         
         messagebox.showinfo('Information', 'Operation successful.')
         self.dupe_window.destroy()
     
     def draw(self):
+        from PIL import Image, ImageTk
+
         dupe_left_frame = tk.Frame(self.dupe_window, width=640, height=600)
         dupe_left_frame.grid(row=0, column=0, padx=5, pady=5, sticky='nsew')
 
@@ -571,22 +1342,339 @@ class DupeWindow:
             pady=5
         )
 
+        self.group_text = tk.StringVar()
+        group_label = tk.Label(
+            self.dupe_window,
+            textvariable=self.group_text,
+            height=2
+        ).grid(
+            row=2,
+            column=0,
+            columnspan=2,
+            padx=5,
+            pady=5
+        )
+
+class DiagnosticsWindow:
+
+    #   Shows the spans and counters collected by diagnostics, exports them
+    #   and starts or stops a cProfile capture of the Tk thread.
+
+    def __init__(self, root):
+        self.window = tk.Toplevel(root)
+        self.window.title('Diagnostics')
+        self.window.geometry('640x480')
+
+        self.text = tk.Text(self.window, wrap='none', font='TkFixedFont')
+        self.text.pack(side=tk.TOP, fill='both', expand=True, padx=5, pady=5)
+
+        buttons = tk.Frame(self.window)
+        buttons.pack(side=tk.BOTTOM, fill='x', padx=5, pady=5)
+        tk.Button(buttons, text='Refresh', command=self.refresh).pack(side=tk.LEFT)
+        tk.Button(buttons, text='Reset', command=self.reset).pack(side=tk.LEFT)
+        tk.Button(buttons, text='Export JSON...', command=self.export_json).pack(side=tk.LEFT)
+        tk.Button(buttons, text='Export Chrome Trace...', command=self.export_trace).pack(side=tk.LEFT)
+        self.profile_text = StringVar()
+        tk.Button(buttons, textvariable=self.profile_text, command=self.toggle_profile).pack(side=tk.RIGHT)
+
+        self.refresh()
+
+    def show(self, text):
+        self.text.config(state=tk.NORMAL)
+        self.text.delete('1.0', tk.END)
+        self.text.insert('1.0', text)
+        self.text.config(state=tk.DISABLED)
+
+    def refresh(self):
+        spans, counters = diagnostics.summary()
+        lines = ['%-20s %8s %12s %10s %10s' % ('span', 'count', 'total ms', 'mean ms', 'max ms')]
+        for name, s in sorted(spans.items(), key=lambda item: -item[1]['total_ms']):
+            lines.append('%-20s %8d %12.1f %10.2f %10.2f' % (name, s['count'], s['total_ms'], s['mean_ms'], s['max_ms']))
+        lines.append('')
+        lines.append('%-20s %8s' % ('counter', 'value'))
+        for name, value in sorted(counters.items()):
+            lines.append('%-20s %8d' % (name, value))
+        self.show('\n'.join(lines))
+        self.profile_text.set('Stop Profile...' if diagnostics.profiling() else 'Start Profile')
+
+    def reset(self):
+        diagnostics.reset()
+        self.refresh()
+
+    def export_json(self):
+        path = filedialog.asksaveasfilename(parent=self.window, defaultextension='.json', filetypes=[('JSON files', '*.json')])
+        if path:
+            diagnostics.export_json(path)
+
+    def export_trace(self):
+        path = filedialog.asksaveasfilename(parent=self.window, defaultextension='.json', filetypes=[('Chrome trace', '*.json')])
+        if path:
+            diagnostics.export_chrome_trace(path)
+
+    def toggle_profile(self):
+        import io
+
+        if not diagnostics.profiling():
+            diagnostics.start_profile()
+            self.refresh()
+            return
+
+        stats = diagnostics.stop_profile()
+        path = filedialog.asksaveasfilename(parent=self.window, defaultextension='.prof', filetypes=[('cProfile output', '*.prof')])
+        if path:
+            stats.dump_stats(path)
+        out = io.StringIO()
+        stats.stream = out
+        stats.sort_stats('cumulative').print_stats(30)
+        self.show(out.getvalue())
+        self.profile_text.set('Start Profile')
+
+class TexDirsWindow:
+
+    #   File > Texture Directories, a modal list of every texture directory
+    #   where the selected ones are active. result is (tex_dirs, active)
+    #   once OK is pressed, None otherwise.
+
+    def __init__(self, root, tex_dirs, active):
+        self.result = None
+        self.tex_dirs = list(tex_dirs)
+
+        self.window = tk.Toplevel(root)
+        self.window.title('Texture Directories')
+        self.window.geometry('560x320')
+        self.window.grab_set()
+
+        self.listbox = tk.Listbox(self.window, selectmode=tk.MULTIPLE, exportselection=False)
+        self.listbox.pack(side=tk.TOP, fill='both', expand=True, padx=5, pady=5)
+        for i, tex_dir in enumerate(self.tex_dirs):
+            self.listbox.insert(tk.END, tex_dir)
+            if tex_dir in active:
+                self.listbox.selection_set(i)
+
+        buttons = tk.Frame(self.window)
+        buttons.pack(side=tk.BOTTOM, fill='x', padx=5, pady=5)
+        tk.Button(buttons, text='Add...', command=self.add).pack(side=tk.LEFT)
+        tk.Button(buttons, text='Remove', command=self.remove).pack(side=tk.LEFT)
+        tk.Button(buttons, text='Cancel', command=self.window.destroy).pack(side=tk.RIGHT)
+        tk.Button(buttons, text='OK', command=self.ok).pack(side=tk.RIGHT)
+
+        self.window.wait_window()
+
+    def add(self):
+        folderpath = filedialog.askdirectory(parent=self.window)
+        if not folderpath or not os.path.exists(folderpath):
+            return
+        folderpath = os.path.abspath(folderpath)
+        if folderpath not in self.tex_dirs:
+            self.tex_dirs.append(folderpath)
+            self.listbox.insert(tk.END, folderpath)
+        self.listbox.selection_set(self.tex_dirs.index(folderpath))
+
+    def remove(self):
+        # Removes the selected directories from the list
+        for i in reversed(self.listbox.curselection()):
+            del self.tex_dirs[i]
+            self.listbox.delete(i)
+
+    def ok(self):
+        active = [self.tex_dirs[i] for i in self.listbox.curselection()]
+        self.result = (self.tex_dirs, active)
+        self.window.destroy()
+
+class HexLabels:
+
+    #   The hexes of a tex_df as VirtualListbox items, a label is only
+    #   formatted when its row is drawn
+
+    def __init__(self, tex_df):
+        # scanner pulls in pandas, so it is not imported with this module
+        import scanner
+
+        self.tex_df = tex_df
+        self.hex_at = scanner.tex_hex_at
+
+    def __len__(self):
+        return len(self.tex_df)
+
+    def __getitem__(self, index):
+        return self.hex_at(self.tex_df, index)
+
+class VirtualListbox(tk.Canvas):
+
+    #   Stand-in for tk.Listbox which only draws the rows that are visible,
+    #   so replacing its items costs O(visible rows) instead of one Tcl
+    #   call per item. Supports the parts of the Listbox API MainWindow uses
+    #   and generates <<ListboxSelect>> the same way.
+    #   items is any sequence with len() and [], e.g. a numpy array
+    #   first is the index of the top visible row
+    #   selected is the selected index, or None
+    #   rows are the canvas text items, reused for whatever row is visible
+
+    def __init__(self, parent, **kw):
+        tk.Canvas.__init__(self, parent, highlightthickness=1, takefocus=1, **kw)
+        self.font = tkfont.nametofont('TkDefaultFont')
+        self.row_height = self.font.metrics('linespace') + 1
+        self.items = []
+        self.first = 0
+        self.selected = None
+        self.rows = []
+        self.highlight = self.create_rectangle(0, 0, 0, 0, fill='#3874d8', outline='', state=tk.HIDDEN)
+
+        self.scrollbar = tk.Scrollbar(self, command=self.yview)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.bind('<Configure>', lambda evt: self.redraw())
+        self.bind('<Button-1>', self.on_click)
+        self.bind('<MouseWheel>', lambda evt: self.yview('scroll', -3 if evt.delta > 0 else 3, 'units'))
+        self.bind('<Button-4>', lambda evt: self.yview('scroll', -3, 'units'))
+        self.bind('<Button-5>', lambda evt: self.yview('scroll', 3, 'units'))
+        self.bind('<Up>', lambda evt: self.move(-1))
+        self.bind('<Down>', lambda evt: self.move(1))
+        self.bind('<Prior>', lambda evt: self.move(-self.page_rows()))
+        self.bind('<Next>', lambda evt: self.move(self.page_rows()))
+        self.bind('<Home>', lambda evt: self.move(-len(self.items)))
+        self.bind('<End>', lambda evt: self.move(len(self.items)))
+
+    def set_items(self, items):
+        self.items = items
+        self.first = 0
+        self.selected = None
+        self.redraw()
+
+    def size(self):
+        return len(self.items)
+
+    def page_rows(self):
+        # Rows which fit completely
+        return max(1, self.winfo_height() // self.row_height)
+
+    def redraw(self):
+        count = self.page_rows() + 1
+        while len(self.rows) < count:
+            self.rows.append(self.create_text(3, 0, anchor=tk.NW, font=self.font))
+
+        for i, row in enumerate(self.rows):
+            index = self.first + i
+            if i < count and index < len(self.items):
+                self.coords(row, 3, i * self.row_height)
+                self.itemconfigure(
+                    row,
+                    text=self.items[index],
+                    fill='white' if index == self.selected else 'black',
+                    state=tk.NORMAL
+                )
+            else:
+                self.itemconfigure(row, state=tk.HIDDEN)
+
+        bbox = self.bbox_index(self.selected) if self.selected is not None else None
+        if bbox:
+            x, y, width, height = bbox
+            self.coords(self.highlight, x, y, x + width, y + height)
+            self.itemconfigure(self.highlight, state=tk.NORMAL)
+        else:
+            self.itemconfigure(self.highlight, state=tk.HIDDEN)
+
+        if len(self.items):
+            self.scrollbar.set(self.first / len(self.items), min(1.0, (self.first + self.page_rows()) / len(self.items)))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def yview(self, *args):
+        if args[0] == 'moveto':
+            first = int(float(args[1]) * len(self.items))
+        elif args[0] == 'scroll' and args[2] == 'pages':
+            first = self.first + int(args[1]) * self.page_rows()
+        elif args[0] == 'scroll':
+            first = self.first + int(args[1])
+        else:
+            return
+        self.first = max(0, min(first, len(self.items) - self.page_rows()))
+        self.redraw()
+
+    def see(self, index):
+        if index < self.first:
+            self.first = index
+        elif index >= self.first + self.page_rows():
+            self.first = index - self.page_rows() + 1
+        self.redraw()
+
+    def nearest(self, y):
+        return max(0, min(self.first + int(y) // self.row_height, len(self.items) - 1))
+
+    def bbox_index(self, index):
+        if not self.first <= index < min(len(self.items), self.first + self.page_rows() + 1):
+            return None
+        return 0, (index - self.first) * self.row_height, self.winfo_width(), self.row_height
+
+    def bbox(self, *args):
+        # bbox(index) as on a Listbox, any other call goes to the Canvas
+        if len(args) == 1 and isinstance(args[0], int):
+            return self.bbox_index(args[0])
+        return tk.Canvas.bbox(self, *args)
+
+    def curselection(self):
+        return () if self.selected is None else (self.selected,)
+
+    def selection_clear(self, first, last=None):
+        self.selected = None
+        self.redraw()
+
+    def selection_set(self, index):
+        self.selected = index
+        self.redraw()
+
+    def activate(self, index):
+        self.see(index)
+
+    def select(self, index):
+        if not len(self.items):
+            return
+        self.selected = max(0, min(index, len(self.items) - 1))
+        self.see(self.selected)
+        self.event_generate('<<ListboxSelect>>')
+
+    def move(self, delta):
+        self.select(delta if self.selected is None else self.selected + delta)
+        return 'break'
+
+    def on_click(self, evt):
+        self.focus_set()
+        if len(self.items):
+            self.select(self.nearest(evt.y))
+
 class LoadingSplash(tk.Toplevel):
     def __init__(self, parent):
         tk.Toplevel.__init__(self, parent)
         self.title("Loading")
         self.geometry('300x200')
         self.resizable(False, False)
+        self.progress_text = tk.StringVar()
+        self.progress_text.set("Loading...")
         label = tk.Label(self, 
-                 text="Loading...",
+                 textvariable=self.progress_text,
                  font=("Arial", 16, "bold"),      
                 )
         
         label.grid(row=0, column=0)
         label.place(relx=0.5, rely=0.5, anchor=tk.CENTER)
         self.update()
+        # update() runs pending events, the menus must not start another
+        # scan while the one showing this splash holds scan_lock
+        try:
+            self.grab_set()
+        except tk.TclError:
+            pass
+
+    def set_progress(self, dirs, files):
+        self.set_message("Loading...\n%d folders, %d files" % (dirs, files))
+
+    def set_message(self, text):
+        self.progress_text.set(text)
+        self.update()
 
 def main():
+    # Needed by the process pools when running from the PyInstaller build
+    multiprocessing.freeze_support()
     main = MainWindow()
 
 if __name__ == "__main__":